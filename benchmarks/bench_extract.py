@@ -0,0 +1,82 @@
+"""Benchmark process_netowl_json against the original implementation.
+
+Runs both extractors over a corpus of saved NetOwl JSON files (for
+example the .json files written with --keep-artifacts) or, without
+--corpus, over synthetic documents. Geocoding is stubbed out so only
+the extraction itself is timed.
+
+    python benchmarks/bench_extract.py --corpus /path/to/harvest
+    python benchmarks/bench_extract.py --synthetic 200 --entities 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bucketize
+import corpus
+import legacy_extract
+
+
+class FixedGeocoder:
+    """Geocoder stand-in that puts every address at the same spot."""
+
+    def geocode_many(self, addresses):
+        return {address: {'x': -117.19, 'y': 34.05} for address in addresses}
+
+
+def time_extractor(extract, documents, repeat):
+    """Return the best seconds over repeat passes and the records of the last one."""
+    best = None
+    for _ in range(repeat):
+        # Fresh copies every pass because the original extractor mutates its input
+        parsed = [json.loads(raw) for raw in documents]
+        started = time.perf_counter()
+        records = 0
+        for n, data in enumerate(parsed):
+            entities, links, events = extract("doc{0}.txt".format(n), data)
+            records += len(entities) + len(links) + len(events)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="Directory of saved NetOwl JSON files.")
+    parser.add_argument("--synthetic", help="Number of synthetic documents when no corpus is given.", type=int, default=100)
+    parser.add_argument("--entities", help="Entities per synthetic document.", type=int, default=300)
+    parser.add_argument("-r", "--repeat", help="Number of timing runs (best is kept).", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.corpus:
+        documents = corpus.load_corpus(args.corpus)
+        if not documents:
+            parser.error("no .json files found in {0}".format(args.corpus))
+    else:
+        documents = [json.dumps(corpus.synthetic_document(args.entities, seed)).encode('utf-8')
+                     for seed in range(args.synthetic)]
+
+    geocoder = FixedGeocoder()
+
+    def current(name, data):
+        return bucketize.process_netowl_json(name, data, "https://example.com", "query", "category", geocoder)
+
+    def original(name, data):
+        return legacy_extract.process_netowl_json(name, data, "https://example.com", "query", "category")
+
+    legacy_seconds, legacy_records = time_extractor(original, documents, args.repeat)
+    current_seconds, current_records = time_extractor(current, documents, args.repeat)
+
+    print("documents:  {0} ({1:.1f} MB)".format(len(documents), sum(map(len, documents)) / 1e6))
+    print("records:    {0} original / {1} current".format(legacy_records, current_records))
+    print("original:   {0:8.1f} docs/s".format(len(documents) / legacy_seconds))
+    print("current:    {0:8.1f} docs/s ({1:.2f}x)".format(len(documents) / current_seconds,
+                                                         legacy_seconds / current_seconds))
+
+
+if __name__ == "__main__":
+    main()
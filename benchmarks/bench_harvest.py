@@ -0,0 +1,144 @@
+"""End-to-end harvest benchmark against local stand-ins for every service.
+
+Starts benchmarks/mock_services.py in-process and runs bucketize.py in a
+subprocess for every combination of document count, document size and
+engine. For each run it reports documents/s, p95 end-to-end document
+latency (from bucketize's --metrics output), peak RSS of the bucketize
+process and what the GeoEvent sink received. Results are written as JSON;
+pass a previous results file with --baseline to see the change.
+
+    python benchmarks/bench_harvest.py --docs 20,100 --sizes small,large -o results.json
+    python benchmarks/bench_harvest.py --latency netowl=300 --error-rate netowl=0.05 --baseline results.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import mock_services
+
+BUCKETIZE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bucketize.py')
+
+# (page KB, NetOwl entities per document) of each document size
+SIZES = {
+    'small': (20, 50),
+    'medium': (200, 500),
+    'large': (1000, 2500),
+}
+
+
+def run_harvest(base, docs, engine, extra_args):
+    """Run bucketize.py against the mock services and return (seconds, peak RSS bytes, metrics, exit code)."""
+    with tempfile.TemporaryDirectory() as directory:
+        metrics_path = os.path.join(directory, 'metrics.json')
+        command = [sys.executable, BUCKETIZE, '-q', 'benchmark', '-m', str(docs), '-c', 'benchmark',
+                   '-g', base + '/geoevent', '--search-url', base + '/search',
+                   '--netowl-url', base + '/netowl', '--geocode-url', base + '/geocode',
+                   '--engine', engine, '--metrics', metrics_path] + extra_args
+        started = time.monotonic()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        # wait4 gives the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.monotonic() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+        metrics = {}
+        if os.path.exists(metrics_path):
+            with open(metrics_path, encoding='utf-8') as metrics_file:
+                metrics = json.load(metrics_file)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return seconds, peak, metrics, process.returncode
+
+
+def compare(results, baseline):
+    """Print how docs/s, p95 latency and peak RSS moved against a baseline results file."""
+    previous = {result['scenario']: result for result in baseline.get('results', [])}
+    print("\nChange against baseline:")
+    for result in results:
+        before = previous.get(result['scenario'])
+        if before is None:
+            continue
+        changes = []
+        for key in ('docs_per_sec', 'p95_ms', 'peak_rss_mb'):
+            if before.get(key) and result.get(key) is not None:
+                changes.append("{0} {1:+.1f}%".format(key, (result[key] / before[key] - 1) * 100))
+        print(" {0:<28} {1}".format(result['scenario'], ", ".join(changes)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", help="Comma separated document counts.", default="20,100")
+    parser.add_argument("--sizes", help="Comma separated document sizes: {0}.".format(", ".join(SIZES)),
+                        default="small,medium")
+    parser.add_argument("--engines", help="Comma separated engines to run.", default="threads,async")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Earlier results file to compare against.")
+    parser.add_argument("bucketize_args", nargs=argparse.REMAINDER,
+                        help="Extra bucketize.py options, after --, e.g. -- -w 8 --stream-json")
+    mock_services.add_arguments(parser)
+    args = parser.parse_args()
+    extra_args = [arg for arg in args.bucketize_args if arg != '--']
+    sizes = args.sizes.split(',')
+    for size in sizes:
+        if size not in SIZES:
+            parser.error("unknown size '{0}', expected one of {1}".format(size, ", ".join(SIZES)))
+
+    mock = mock_services.build_mock(args)
+    server, base = mock_services.start(mock)
+
+    results = []
+    print("{0:<28} {1:>9} {2:>9} {3:>9} {4:>9} {5:>10}".format(
+        'scenario', 'docs/s', 'p95 ms', 'RSS MB', 'entities', 'errors'))
+    try:
+        for size in sizes:
+            mock.page_kb, mock.entities = SIZES[size]
+            mock.generated.clear()
+            for docs in [int(n) for n in args.docs.split(',')]:
+                for engine in args.engines.split(','):
+                    mock.reset()
+                    seconds, peak, metrics, code = run_harvest(base, docs, engine, extra_args)
+                    stats = mock.stats()
+                    document = metrics.get('stages', {}).get('document', {})
+                    done = metrics.get('counters', {}).get('documents', 0)
+                    result = {
+                        'scenario': "{0}-{1}docs-{2}".format(size, docs, engine),
+                        'size': size, 'page_kb': mock.page_kb, 'entities_per_doc': mock.entities,
+                        'docs': docs, 'engine': engine, 'exit_code': code,
+                        'seconds': seconds,
+                        'docs_completed': done,
+                        'docs_per_sec': done / seconds if seconds else None,
+                        'p50_ms': document.get('p50', 0) * 1000,
+                        'p95_ms': document.get('p95', 0) * 1000,
+                        'peak_rss_mb': peak / (1024 * 1024),
+                        'services': stats,
+                        'stages': metrics.get('stages', {}),
+                    }
+                    results.append(result)
+                    print("{0:<28} {1:>9.1f} {2:>9.0f} {3:>9.1f} {4:>9} {5:>10}".format(
+                        result['scenario'], result['docs_per_sec'], result['p95_ms'], result['peak_rss_mb'],
+                        stats['geoevent']['entities'], sum(stats['errors'].values())))
+    finally:
+        server.shutdown()
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'latency_ms': mock.latency,
+        'error_rate': mock.error_rate,
+        'bucketize_args': extra_args,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+        print("Results written to {0}".format(args.output))
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    main()
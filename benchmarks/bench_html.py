@@ -0,0 +1,81 @@
+"""Benchmark the HTML to visible text extraction paths.
+
+Compares BeautifulSoup against the streaming lxml parser on a directory
+of saved HTML pages or, without --fixtures, on synthetic pages. Reports
+pages/s, MB/s, peak Python memory (tracemalloc, so allocations inside
+libxml2 are not counted) and whether both paths produced the same text.
+
+    python benchmarks/bench_html.py --fixtures /path/to/pages
+    python benchmarks/bench_html.py --synthetic 50 --size 500
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import extraction
+from corpus import synthetic_page
+
+
+def load_pages(directory):
+    """Return the raw bytes of every .html/.htm file under directory."""
+    pages = []
+    for pattern in ("*.html", "*.htm"):
+        for path in sorted(glob.glob(os.path.join(directory, "**", pattern), recursive=True)):
+            with open(path, 'rb') as html_file:
+                pages.append(html_file.read())
+    return pages
+
+
+def run(parser, pages, repeat):
+    """Return (best seconds, peak traced bytes, texts) for one parser."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        texts = [extraction.extract_visible_text(page, parser) for page in pages]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    for page in pages:
+        extraction.extract_visible_text(page, parser)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, texts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", help="Directory of saved HTML pages.")
+    parser.add_argument("--synthetic", help="Number of synthetic pages when no fixtures are given.", type=int, default=40)
+    parser.add_argument("--size", help="Size of each synthetic page in KB.", type=int, default=300)
+    parser.add_argument("-r", "--repeat", help="Number of timing runs (best is kept).", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.fixtures:
+        pages = load_pages(args.fixtures)
+        if not pages:
+            parser.error("no .html files found in {0}".format(args.fixtures))
+    else:
+        pages = [synthetic_page(args.size, seed) for seed in range(args.synthetic)]
+
+    megabytes = sum(map(len, pages)) / 1e6
+    print("pages: {0} ({1:.1f} MB)".format(len(pages), megabytes))
+
+    results = {}
+    for name in ('bs4', 'lxml'):
+        seconds, peak, texts = run(name, pages, args.repeat)
+        results[name] = texts
+        print("{0:<5} {1:8.1f} pages/s {2:7.1f} MB/s   peak {3:7.1f} MB".format(
+            name, len(pages) / seconds, megabytes / seconds, peak / 1e6))
+
+    same = sum(1 for a, b in zip(results['bs4'], results['lxml']) if a == b)
+    print("identical text: {0}/{1} pages".format(same, len(pages)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Micro-benchmark for the NetOwl record classes.
+
+Compares the __slots__ records in bucketize.py against the original
+__dict__-based entity class: memory per object and serialization
+throughput of toJSON() versus the compact serializer.
+
+    python benchmarks/bench_records.py -n 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bucketize
+
+
+class Legacy_Entity:
+    """The original NetOwl_Entity, kept here as the baseline."""
+
+    def __init__(self, value_dict=None):
+        if 'id' in value_dict:
+            self.id = value_dict['id']
+        if 'ontology' in value_dict:
+            self.ontology = value_dict['ontology']
+        if 'value' in value_dict:
+            self.value = value_dict['value']
+        if 'norm' in value_dict:
+            self.norm = value_dict['norm']
+        if 'head' in value_dict:
+            self.pre_text = value_dict['head']
+        if 'tail' in value_dict:
+            self.post_text = value_dict['tail']
+        if 'doc_link' in value_dict:
+            self.doc_link = value_dict['doc_link']
+        if 'query' in value_dict:
+            self.query = value_dict['query']
+        if 'category' in value_dict:
+            self.category = value_dict['category']
+
+        if 'geo_entity' in value_dict:
+            self.geo_entity = value_dict['geo_entity']
+            self.loc = [value_dict['long'], value_dict['lat']]
+            self.lat = value_dict['lat']
+            self.long = value_dict['long']
+            self.geo_type = value_dict['geo_type']
+            self.geo_subtype = value_dict['geo_subtype']
+        else:
+            self.geo_entity = False
+
+    def toJSON(self):
+        return json.dumps(self, default=lambda o: o.__dict__,
+            sort_keys=True, indent=4)
+
+
+def sample_values(n):
+    """Entity dicts shaped like the ones process_netowl_json builds."""
+    values = []
+    for i in range(n):
+        value = {
+            'id': 'Japan_Food1_e_id{0}'.format(i),
+            'ontology': 'entity:place:city',
+            'value': 'Tokyo',
+            'norm': 'Tokyo',
+            'head': 'Rice harvested around ',
+            'tail': ' is shipped to warehouses across the region.',
+            'doc_link': 'https://example.com/japan/food/{0}'.format(i % 50),
+            'query': 'Japan Food Production',
+            'category': 'Food Production Center',
+        }
+        if i % 2 == 0:
+            value.update({'geo_entity': True, 'lat': 35.68, 'long': 139.69,
+                          'geo_type': 'placename', 'geo_subtype': 'city'})
+        values.append(value)
+    return values
+
+
+def measure_memory(cls, values):
+    """Return bytes allocated per object while building cls(value) for every value."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = [cls(value) for value in values]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    # Leave out the list holding the objects
+    allocated -= sys.getsizeof(objects)
+    return allocated / len(objects)
+
+
+def measure_throughput(func, objects, repeat):
+    """Return the best objects/second over repeat runs of func(objects)."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(objects)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(objects) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--count", help="Number of entities to build.", type=int, default=20000)
+    parser.add_argument("-r", "--repeat", help="Number of timing runs (best is kept).", type=int, default=5)
+    args = parser.parse_args()
+
+    values = sample_values(args.count)
+    legacy = [Legacy_Entity(value) for value in values]
+    slotted = [bucketize.NetOwl_Entity(value) for value in values]
+
+    legacy_bytes = measure_memory(Legacy_Entity, values)
+    slotted_bytes = measure_memory(bucketize.NetOwl_Entity, values)
+
+    print("entities:            {0}".format(args.count))
+    print("compact backend:     {0}".format("orjson" if bucketize.orjson is not None else "json"))
+    print("")
+    print("memory per object")
+    print("  __dict__ entity:   {0:8.0f} bytes".format(legacy_bytes))
+    print("  __slots__ entity:  {0:8.0f} bytes ({1:.0f} saved)".format(slotted_bytes, legacy_bytes - slotted_bytes))
+    print("")
+    print("serialization throughput")
+    rates = [
+        ("legacy toJSON", measure_throughput(lambda objs: [o.toJSON() for o in objs], legacy, args.repeat)),
+        ("slots toJSON", measure_throughput(lambda objs: [o.toJSON() for o in objs], slotted, args.repeat)),
+        ("compact per object", measure_throughput(lambda objs: [o.toCompactJSON() for o in objs], slotted, args.repeat)),
+        ("compact bulk array", measure_throughput(bucketize.dumps_compact, slotted, args.repeat)),
+    ]
+    baseline = rates[0][1]
+    for name, rate in rates:
+        print("  {0:<19} {1:10.0f} objects/s ({2:.1f}x)".format(name + ':', rate, rate / baseline))
+
+
+if __name__ == "__main__":
+    main()
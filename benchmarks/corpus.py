@@ -0,0 +1,86 @@
+"""Load saved NetOwl JSON documents, or generate synthetic ones and HTML pages, for the benchmarks."""
+import glob
+import os
+import random
+
+ONTOLOGIES = [
+    "entity:place:city", "entity:place:country", "entity:place:province",
+    "entity:numeric:coordinate:latlong", "entity:address:mail", "entity:place:other",
+    "entity:organization:facility", "entity:organization:company", "entity:person",
+    "entity:place:water",
+]
+
+WORDS = ("rice harvest warehouse shipment port distribution center tokyo osaka "
+         "prefecture cooperative export cold storage facility logistics").split()
+
+
+def load_corpus(directory):
+    """Return the raw bytes of every .json file under directory."""
+    paths = sorted(glob.glob(os.path.join(directory, "**", "*.json"), recursive=True))
+    documents = []
+    for path in paths:
+        with open(path, 'rb') as json_file:
+            documents.append(json_file.read())
+    return documents
+
+
+def synthetic_document(entities=200, seed=0, words=3000):
+    """Build a NetOwl-shaped document with entities, links and events."""
+    rnd = random.Random(seed)
+    content = " ".join(rnd.choice(WORDS) for _ in range(words))
+
+    document = {'text': [{'content': content}], 'entity': [], 'link': [], 'event': []}
+    for n in range(entities):
+        ontology = rnd.choice(ONTOLOGIES)
+        head = rnd.randrange(0, max(1, len(content) - 20))
+        entity = {
+            'id': 'id{0}'.format(n),
+            'ontology': ontology,
+            'value': content[head:head + 12],
+            'norm': content[head:head + 12].title(),
+            'entity-mention': [{'head': str(head), 'tail': str(head + 12)}],
+        }
+        if ontology.startswith("entity:place") or ontology.startswith("entity:numeric"):
+            entity['geodetic'] = {'latitude': str(rnd.uniform(30, 45)), 'longitude': str(rnd.uniform(129, 145))}
+        if ontology == "entity:address:mail":
+            entity['value'] = "{0} Chuo-dori, Osaka".format(rnd.randrange(1, 40))
+        if n and n % 4 == 0:
+            entity['link-ref'] = [{
+                'ontology': 'link:geo:in', 'role': 'place', 'role-type': 'entity',
+                'entity-arg': [{'role': 'container', 'role-type': 'entity', 'value': 'Japan',
+                                'value-type': 'name', 'idref': 'id{0}'.format(n - 1),
+                                'ontology': 'entity:place:country'}],
+            }]
+        document['entity'].append(entity)
+
+    for n in range(1, entities, 5):
+        document['link'].append({
+            'ontology': 'link:geo:in',
+            'entity-arg': [
+                {'role': 'place', 'role-type': 'entity', 'value': 'Osaka', 'idref': 'id{0}'.format(n),
+                 'ontology': 'entity:place:city'},
+                {'role': 'container', 'role-type': 'entity', 'value': 'Japan', 'value-type': 'name',
+                 'idref': 'id{0}'.format(n - 1), 'ontology': 'entity:place:country'},
+            ],
+        })
+
+    for n in range(2, entities, 7):
+        args = [{'role': 'agent', 'value': 'warehouse', 'value-type': 'name', 'idref': 'id{0}'.format(n - k),
+                 'ontology': 'entity:organization:facility'} for k in range(rnd.randrange(1, 4))]
+        document['event'].append({'entity-arg': args, 'property': [{'value': 'ship'}]})
+
+    return {'document': [document]}
+
+
+def synthetic_page(size_kb, seed):
+    """Build a page of roughly size_kb kilobytes with scripts, styles and nested markup."""
+    rnd = random.Random(seed)
+    parts = ['<!DOCTYPE html><html><head><title>Harvest</title>',
+             '<style>body { font-family: sans-serif; } .nav { display: none; }</style>',
+             '<script>var tracking = {"id": 1234, "events": []};</script></head><body>']
+    while sum(map(len, parts)) < size_kb * 1024:
+        words = " ".join(rnd.choice(WORDS) for _ in range(rnd.randrange(20, 80)))
+        parts.append('<div class="section"><h2>{0}</h2><p>{1} <a href="/x">{0}</a> &amp; more</p>'
+                     '<script>render({2});</script><!-- comment --></div>'.format(words[:20], words, rnd.random()))
+    parts.append('</body></html>')
+    return ''.join(parts).encode('utf-8')
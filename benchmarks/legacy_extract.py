@@ -0,0 +1,237 @@
+"""The original process_netowl_json, kept as the baseline for bench_extract.py.
+
+It mutates the entity ids of the document it is given, so hand it a
+fresh copy on every call.
+"""
+import string
+
+from bucketize import NetOwl_Entity, NetOwl_Event, NetOwl_Link, Text_Item, get_head, get_tail
+
+
+def geocode_address(address):
+    """Fixed location so the benchmark never touches the network."""
+    return {'x': -117.19, 'y': 34.05}
+
+
+def cleanup_text(intext):
+    """Function to remove funky chars."""
+    printable = set(string.printable)
+    p = ''.join(filter(lambda x: x in printable, intext))
+    g = p.replace('"', "")
+    return g
+
+
+def process_netowl_json(document_file, json_data, web_url, query_string, category):
+    doc_entities = []
+    doc_links = []
+    doc_events = []
+    
+    # Open main portion of output NetOwl JSON
+    if 'document' in json_data:
+        document = json_data['document'][0]
+                    
+        # Extract source text that is embedded in NetOwl JSON and save it as a Text_Item class object
+        if 'text' in document:
+            content = document['text'][0]['content']
+                        
+            content_object = Text_Item(doc_id=document_file, text_content=content)
+                        
+        if 'entity' in document:
+            # Build entity objects
+            ents = (document['entity'])  # gets all entities in doc
+
+            # Iterates through entities in the document
+            for e in ents:
+                base_entity = {}
+
+                # gather data from each entity
+                rdfvalue = cleanup_text(e['value'])  # value (ie name)
+                rdfid = e['id']
+                rdfid = document_file.split(".")[0] + "_e_" + rdfid  # unique to each entity
+                e['id'] = rdfid
+
+                base_entity['id'] = rdfid
+
+                if 'ontology' in e:
+                    base_entity['ontology'] = e['ontology']
+                if 'value' in e:
+                    base_entity['value'] = e['value']
+                if 'norm' in e:
+                    base_entity['norm'] = e['norm']
+
+                if 'geodetic' in e:
+                    base_entity['geo_entity'] = True
+                    base_entity['lat'] = float(e['geodetic']['latitude'])
+                    base_entity['long'] = float(e['geodetic']['longitude'])
+
+                # check for addresses
+                if e['ontology'] == "entity:address:mail":
+                    address = e['value']
+                    location = geocode_address(address)  # returns x,y
+
+                    base_entity['geo_entity'] = True
+                    base_entity['lat'] = location['y']
+                    base_entity['long'] = location['x']
+                    
+                # Sets the type of the geo-entity to allow for better symbology
+
+                if 'geo_entity' in base_entity:
+                    base_entity['geo_type'] = "placename"
+                    base_entity['geo_subtype'] = "unknown"
+
+                    if e['ontology'] == "entity:place:city":
+                        base_entity['geo_type'] = "placename"
+                        base_entity['geo_subtype'] = "city"
+                    if e['ontology'] == "entity:place:country":
+                        base_entity['geo_type'] = "placename"
+                        base_entity['geo_subtype'] = "country"
+                    if e['ontology'] == "entity:place:province":
+                        base_entity['geo_type'] = "placename"
+                        base_entity['geo_subtype'] = "province"
+                    if e['ontology'] == "entity:place:continent":
+                        base_entity['geo_type'] = "placename"
+                        base_entity['geo_subtype'] = "continent"
+                    if e['ontology'] == "entity:numeric:coordinate:mgrs":
+                        base_entity['geo_type'] = "coordinate"
+                        base_entity['geo_subtype'] = "MGRS"
+                    if e['ontology'] == "entity:numeric:coordinate:latlong":
+                        base_entity['geo_type'] = "coordinate"
+                        base_entity['geo_subtype'] = "latlong"
+                    if e['ontology'] == "entity:address:mail":
+                        base_entity['geo_type'] = "address"
+                        base_entity['geo_subtype'] = "mail"
+                    if e['ontology'] == "entity:place:other":
+                        base_entity['geo_type'] = "placename"
+                        base_entity['geo_subtype'] = "descriptor"
+                    if e['ontology'] == "entity:place:landform":
+                        base_entity['geo_type'] = "placename"
+                        base_entity['geo_subtype'] = "landform"
+                    if e['ontology'] == "entity:organization:facility":
+                        base_entity['geo_type'] = "placename"
+                        base_entity['geo_subtype'] = "facility"
+                    if e['ontology'] == "entity:place:water":
+                        base_entity['geo_type'] = "placename"
+                        base_entity['geo_subtype'] = "water"
+                    if e['ontology'] == "entity:place:county":
+                        base_entity['geo_type'] = "placename"
+                        base_entity['geo_subtype'] = "county"
+                
+                if 'entity-mention' in e:
+                    em = e['entity-mention'][0]
+                    if 'head' in em:
+                        base_entity['head'] = get_head(content, int(em['head']), 255)
+                    if 'tail' in em:
+                        base_entity['tail'] = get_tail(content, int(em['tail']), 255)
+
+                base_entity['doc_link'] = web_url
+                base_entity['query'] = query_string
+                base_entity['category'] = category
+
+                # Turns entity information into a class object for storage and transformation
+                netowl_entity_object = NetOwl_Entity(base_entity)
+                doc_entities.append(netowl_entity_object)
+
+                # Returns extracted links from the entity
+                if 'link-ref' in e:
+                    base_entity['has_links'] = True
+
+                    base_link = {}
+
+                    base_link['id'] = rdfid
+
+                    if 'value' in e:
+                        base_link['value'] = e['value']
+                    if 'norm' in e:
+                        base_link['norm'] = e['norm']
+                    link_ref = e['link-ref']
+                    for link in link_ref:
+                        if 'ontology' in link:
+                            base_link['ontology'] = link['ontology']
+                        if 'role' in link:
+                            base_link['role'] = link['role']
+                        if 'role-type' in link:
+                            base_link['role-type'] = link['role-type']
+                        if 'role' in link['entity-arg'][0]:
+                            base_link['link-role'] = link['entity-arg'][0]['role']
+                        if 'role-type' in link['entity-arg'][0]:
+                            base_link['link-role-type'] = link['entity-arg'][0]['role-type']
+                        if 'value' in link['entity-arg'][0]:
+                            base_link['link-value'] = link['entity-arg'][0]['value']
+                        if 'value-type' in link['entity-arg'][0]:
+                            base_link['link-value-type'] = link['entity-arg'][0]['value-type']
+                        if 'idref' in link['entity-arg'][0]:
+                            base_link['link-id'] = document_file.split(".")[0] + "_e_" + link['entity-arg'][0]['idref']
+                        if 'ontology' in link:
+                            base_link['link-ontology'] = link['entity-arg'][0]['ontology']
+                            base_link['ent-ontology'] = e['ontology']
+
+                        netowl_link_object = NetOwl_Link(base_link)
+                        doc_links.append(netowl_link_object)
+            
+        # Determines if there are extracted links in the document
+        if 'link' in document:
+            links = (document['link'])
+            for link in links:
+                base_link = {}
+                
+                base_link['ontology'] = link['ontology']
+                entity_arg1 = link['entity-arg'][0]
+                entity_arg2 = link['entity-arg'][1]
+                
+                base_link['role'] = entity_arg1['role']
+                base_link['role-type'] = entity_arg1['role-type']
+                base_link['value'] = entity_arg1['value']
+                base_link['role'] = entity_arg1['role']
+                base_link['id'] = document_file.split(".")[0] + "_e_" + entity_arg1['idref']
+                base_link['ent-ontology'] = entity_arg1['ontology']
+                base_link['link-role'] = entity_arg2['role']
+                base_link['link-role-type'] = entity_arg2['role']
+                base_link['link-value'] = entity_arg2['value']
+                base_link['link-value-type'] = entity_arg2['value-type']
+                base_link['link-id'] = document_file.split(".")[0] + "_e_" + entity_arg2['idref']
+                base_link['link-ontology'] = entity_arg2['ontology']
+                
+                netowl_link_object = NetOwl_Link(base_link)
+                doc_links.append(netowl_link_object)
+
+        # Determines if there are extracted events in the document
+        if 'event' in document:
+            events = (document['event'])
+            for event in events:
+                base_event = {}
+                
+                event_args = event['entity-arg']
+                event_properties = event['property'][0]
+                    
+                
+                base_event['event-role'] = event_args[0]['role']
+                base_event['event-value'] = event_args[0]['value']
+                base_event['event-value-type'] = event_args[0]['value-type']
+                base_event['event-id'] = document_file.split(".")[0] + "_e_" + event_args[0]['idref']
+                base_event['ent-ontology'] = event_args[0]['ontology']
+                base_event['predicate'] = event_properties['value']
+                
+                if len(event['entity-arg']) > 1:
+                    count = 0
+                    for arg in event_args:
+                        count +=1
+                        if count == 1:
+                            pass
+                        else:
+                            arg_dict = base_event.copy()
+                            event_arg = event['entity-arg'][1]
+                            arg_dict['arg-role'] = arg['role']
+                            arg_dict['arg-value'] = arg['value']
+                            arg_dict['arg-value-type'] = arg['value-type']
+                            arg_dict['arg-id'] = document_file.split(".")[0] + "_e_" + arg['idref']
+                            arg_dict['arg-ontology'] = arg['ontology']
+                            arg_dict['triple'] = True
+                    
+                            netowl_event_object = NetOwl_Event(arg_dict)
+                            doc_events.append(netowl_event_object)
+
+                else:
+                    netowl_event_object = NetOwl_Event(base_event)
+                    doc_events.append(netowl_event_object)
+                
+        return doc_entities, doc_links, doc_events
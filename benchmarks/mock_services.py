@@ -0,0 +1,264 @@
+"""Local stand-ins for the services bucketize talks to.
+
+One HTTP server plays every part, routed by path:
+
+    GET  /search?q=...&num=N           search service, answers {"results": [url, ...]}
+    GET  /pages/<n>.html               harvested page n
+    POST /netowl                       NetOwl _process
+    GET  /geocode/findAddressCandidates
+    POST /geocode/geocodeAddresses     ArcGIS World Geocoder
+    POST /geoevent                     GeoEvent receiver, counts what it is sent
+    GET  /stats                        requests, errors and GeoEvent throughput so far
+
+Pages and NetOwl responses are replayed from a fixtures directory
+(pages/*.html and netowl/*.json, e.g. the .txt.json files written with
+--keep-artifacts) or generated. Every service gets its own latency and
+error rate; failed requests answer 503 with a Retry-After header.
+
+    python benchmarks/mock_services.py --port 8000 --latency netowl=200 --error-rate netowl=0.05
+    python bucketize.py -q test -m 50 -c test -g http://127.0.0.1:8000/geoevent \\
+        --search-url http://127.0.0.1:8000/search --netowl-url http://127.0.0.1:8000/netowl \\
+        --geocode-url http://127.0.0.1:8000/geocode
+"""
+import argparse
+import glob
+import hashlib
+import http.server
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from corpus import load_corpus, synthetic_document, synthetic_page
+
+SERVICES = ('search', 'pages', 'netowl', 'geocode', 'geoevent')
+
+# Milliseconds each service takes to answer by default
+DEFAULT_LATENCY = {'search': 5, 'pages': 20, 'netowl': 100, 'geocode': 20, 'geoevent': 5}
+
+
+def parse_setting(value):
+    """Parse a SERVICE=NUMBER command line option."""
+    service, _, number = value.partition('=')
+    if service not in SERVICES:
+        raise argparse.ArgumentTypeError("expected SERVICE=NUMBER with SERVICE one of {0}".format(', '.join(SERVICES)))
+    try:
+        return service, float(number)
+    except ValueError:
+        raise argparse.ArgumentTypeError("'{0}' is not a number".format(number))
+
+
+class MockServices:
+    """Content, latency and error settings and counters shared by the request handlers."""
+
+    def __init__(self, pages=None, netowl=None, page_kb=50, entities=100, latency=None, error_rate=None,
+                 seed=0):
+        self.pages = pages or []
+        self.netowl = netowl or []
+        self.page_kb = page_kb
+        self.entities = entities
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.error_rate = dict.fromkeys(SERVICES, 0.0)
+        self.error_rate.update(error_rate or {})
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.generated = {}
+        self.reset()
+
+    def reset(self):
+        """Forget the counters of the previous run."""
+        with self.lock:
+            self.requests = dict.fromkeys(SERVICES, 0)
+            self.errors = dict.fromkeys(SERVICES, 0)
+            self.entities_received = 0
+            self.bytes_received = 0
+            self.first_post = self.last_post = None
+
+    def enter(self, service):
+        """Count a request, sleep for the service latency and return False when it should fail."""
+        with self.lock:
+            self.requests[service] += 1
+            failed = self.random.random() < self.error_rate[service]
+            if failed:
+                self.errors[service] += 1
+        delay = self.latency[service] / 1000.0
+        if delay:
+            time.sleep(self.random.uniform(0.5, 1.5) * delay)
+        return not failed
+
+    def page(self, n):
+        if self.pages:
+            return self.pages[n % len(self.pages)]
+        return self._generated(('page', n), lambda: synthetic_page(self.page_kb, n))
+
+    def netowl_response(self, body):
+        # The same text always gets the same answer, like the real service
+        n = int(hashlib.sha256(body).hexdigest()[:8], 16)
+        if self.netowl:
+            return self.netowl[n % len(self.netowl)]
+        return self._generated(('netowl', n % 64),
+                               lambda: json.dumps(synthetic_document(self.entities, seed=n % 64)).encode('utf-8'))
+
+    def _generated(self, key, build):
+        with self.lock:
+            body = self.generated.get(key)
+        if body is None:
+            body = build()
+            with self.lock:
+                self.generated[key] = body
+        return body
+
+    def received(self, body):
+        """Record a batch posted to the GeoEvent sink."""
+        try:
+            count = len(json.loads(body))
+        except ValueError:
+            count = 0
+        now = time.monotonic()
+        with self.lock:
+            self.entities_received += count
+            self.bytes_received += len(body)
+            if self.first_post is None:
+                self.first_post = now
+            self.last_post = now
+
+    def stats(self):
+        with self.lock:
+            span = (self.last_post - self.first_post) if self.first_post is not None else 0.0
+            return {
+                'requests': dict(self.requests),
+                'errors': dict(self.errors),
+                'geoevent': {
+                    'entities': self.entities_received,
+                    'bytes': self.bytes_received,
+                    'entities_per_sec': self.entities_received / span if span > 0 else None,
+                },
+            }
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, data):
+        self._send(200, json.dumps(data).encode('utf-8'))
+
+    def _enter(self, service):
+        if self.server.mock.enter(service):
+            return True
+        self._send(503, b'{"error": "unavailable"}', headers={'Retry-After': '1'})
+        return False
+
+    def do_GET(self):
+        mock = self.server.mock
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/stats':
+            return self._json(mock.stats())
+        if url.path == '/search':
+            if self._enter('search'):
+                num = int(query.get('num', ['10'])[0])
+                base = 'http://{0}:{1}'.format(*self.server.server_address[:2])
+                self._json({'results': ['{0}/pages/{1}.html'.format(base, n) for n in range(num)]})
+            return
+        if url.path.startswith('/pages/'):
+            if self._enter('pages'):
+                n = int(os.path.splitext(os.path.basename(url.path))[0])
+                self._send(200, mock.page(n), 'text/html')
+            return
+        if url.path.startswith('/geocode/'):
+            if self._enter('geocode'):
+                self._json({'candidates': [{'location': {'x': 135.5, 'y': 34.7}, 'score': 100}]})
+            return
+        self._send(404, b'{}')
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = urlparse(self.path).path
+        if path == '/netowl':
+            if self._enter('netowl'):
+                self._send(200, mock.netowl_response(body))
+            return
+        if path.startswith('/geocode/'):
+            if self._enter('geocode'):
+                records = json.loads(parse_qs(body.decode('utf-8')).get('addresses', ['{}'])[0]).get('records', [])
+                self._json({'locations': [{'attributes': {'ResultID': r['attributes']['OBJECTID']},
+                                           'location': {'x': 135.5, 'y': 34.7}, 'score': 100}
+                                          for r in records]})
+            return
+        if path == '/geoevent':
+            if self._enter('geoevent'):
+                mock.received(body)
+                self._send(200, b'')
+            return
+        self._send(404, b'{}')
+
+
+def load_fixtures(directory):
+    """Return the (pages, netowl responses) saved under directory."""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, 'pages', '**', '*.htm*'), recursive=True)):
+        with open(path, 'rb') as page_file:
+            pages.append(page_file.read())
+    return pages, load_corpus(os.path.join(directory, 'netowl'))
+
+
+def start(mock, host='127.0.0.1', port=0):
+    """Serve mock on a background thread and return (server, base URL)."""
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.mock = mock
+    threading.Thread(target=server.serve_forever, name="mock-services", daemon=True).start()
+    return server, 'http://{0}:{1}'.format(host, server.server_address[1])
+
+
+def add_arguments(parser):
+    """Add the content, latency and error rate options shared with bench_harvest.py."""
+    parser.add_argument("--fixtures", help="Directory with pages/*.html and netowl/*.json to replay.")
+    parser.add_argument("--latency", help="Mean response time of a service as SERVICE=MS; may be repeated.",
+                        type=parse_setting, action="append", default=[])
+    parser.add_argument("--error-rate", help="Fraction of requests a service fails as SERVICE=RATE; may be repeated.",
+                        type=parse_setting, action="append", default=[])
+    parser.add_argument("--seed", help="Seed for latency jitter and errors.", type=int, default=0)
+
+
+def build_mock(args, page_kb=50, entities=100):
+    pages, netowl = load_fixtures(args.fixtures) if args.fixtures else ([], [])
+    return MockServices(pages, netowl, page_kb, entities, latency=dict(args.latency),
+                        error_rate=dict(args.error_rate), seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--page-kb", help="Size of generated pages in KB.", type=int, default=50)
+    parser.add_argument("--entities", help="Entities in each generated NetOwl response.", type=int, default=100)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, base = start(build_mock(args, args.page_kb, args.entities), args.host, args.port)
+    print("Serving search, pages, NetOwl, geocoder and GeoEvent at {0}".format(base))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
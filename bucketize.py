@@ -1,41 +1,131 @@
 import argparse
+import asyncio
+import csv
+import email.utils
+import hashlib
+import io
 import requests
 import os
 import json
+import queue
+import re
+import shutil
+import sqlite3
 import string
+import sys
+import tempfile
+import threading
+import time
 import urllib3
-from bs4 import BeautifulSoup
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from export import RecordExporter
+from extraction import PARSERS, content_charset, extract_visible_text, read_limited
+from metrics import Metrics, Profiler
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
 
 try: 
     from googlesearch import search 
 except ImportError:  
     print("No module named 'google' found")
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Default endpoints; --netowl-url and --geocode-url point a run elsewhere
+NETOWL_URL = 'https://api.netowl.com/api/v2/_process'
+NETOWL_PARAMS = {"language": "english", "text": "", "mentions": ""}
+GEOCODE_SERVER_URL = "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer"
+GEOCODE_URL = GEOCODE_SERVER_URL + "/findAddressCandidates"
+GEOCODE_BATCH_URL = GEOCODE_SERVER_URL + "/geocodeAddresses"
+
+# Largest page body downloaded by default; anything past it is cut off
+MAX_PAGE_BYTES = 10 * 1024 * 1024
+
+# Responses worth retrying before giving up on a request
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Services the RateLimiter keeps a token bucket for; any other URL is a harvested page
+SERVICES = ('search', 'pages', 'netowl', 'geocode', 'geoevent')
+
+# Stage timings, byte and record counts and queue depths of the current run
+metrics = Metrics()
+
 # NetOwl Class Objects
-class NetOwl_Entity:
+class NetOwl_Record:
+    """Base class for fixed-schema NetOwl records.
+
+    Each subclass lists its fields in __slots__, in the (sorted) order they
+    are serialized. Fields that were not provided are None and are left
+    out of the JSON output.
+    """
+
+    __slots__ = ()
+
+    def to_dict(self):
+        """Return the fields that are set, in serialization order."""
+        values = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None:
+                values[name] = value
+        return values
+
+    def toJSON(self):
+        """Method to turn class into JSON object"""
+        return json.dumps(self.to_dict(), sort_keys=True, indent=4)
+
+    def toCompactJSON(self):
+        """Method to turn class into compact JSON bytes"""
+        return dumps_compact(self.to_dict())
+
+def dumps_compact(data):
+    """Serialize records (or plain JSON data) to compact JSON bytes.
+
+    Uses orjson when it is installed and the standard library otherwise.
+    """
+    if isinstance(data, NetOwl_Record):
+        data = data.to_dict()
+    elif isinstance(data, list):
+        data = [item.to_dict() if isinstance(item, NetOwl_Record) else item for item in data]
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+class NetOwl_Entity(NetOwl_Record):
     """Class to hold entities extracted from NetOwl API"""
-    
+
+    record_type = 'entity'
+
+    __slots__ = ('category', 'doc_link', 'geo_entity', 'geo_subtype', 'geo_type', 'id', 'lat',
+                 'loc', 'long', 'norm', 'ontology', 'post_text', 'pre_text', 'query', 'value')
+
     def __init__(self, value_dict=None): 
-        """Docstring."""
+        """Build an entity from the dict assembled by process_netowl_json."""
 
-        if 'id' in value_dict:
-            self.id = value_dict['id']
-        if 'ontology' in value_dict:
-            self.ontology = value_dict['ontology']
-        if 'value' in value_dict:
-            self.value = value_dict['value']
-        if 'norm' in value_dict:
-            self.norm = value_dict['norm']
-        if 'head' in value_dict:
-            self.pre_text = value_dict['head']
-        if 'tail' in value_dict:
-            self.post_text = value_dict['tail']
-        if 'doc_link' in value_dict:
-            self.doc_link = value_dict['doc_link']
-        if 'query' in value_dict:
-            self.query = value_dict['query']
-        if 'category' in value_dict:
-            self.category = value_dict['category']
+        self.id = value_dict.get('id')
+        self.ontology = value_dict.get('ontology')
+        self.value = value_dict.get('value')
+        self.norm = value_dict.get('norm')
+        self.pre_text = value_dict.get('head')
+        self.post_text = value_dict.get('tail')
+        self.doc_link = value_dict.get('doc_link')
+        self.query = value_dict.get('query')
+        self.category = value_dict.get('category')
 
         if 'geo_entity' in value_dict:
             self.geo_entity = value_dict['geo_entity']
@@ -46,54 +136,45 @@ class NetOwl_Entity:
             self.geo_subtype = value_dict['geo_subtype']
         else:
             self.geo_entity = False
+            self.loc = self.lat = self.long = None
+            self.geo_type = self.geo_subtype = None
 
-    def toJSON(self):
-        """Method to turn class into JSON object"""
-        return json.dumps(self, default=lambda o: o.__dict__, 
-            sort_keys=True, indent=4)
-
-class NetOwl_Link:
+class NetOwl_Link(NetOwl_Record):
     """Class to hold links extracted from NetOwl API"""
-    
+
+    record_type = 'link'
+
+    __slots__ = ('ent_ontology', 'link_id', 'link_ontology', 'link_role', 'link_role_type',
+                 'link_value', 'link_value_type', 'norm', 'ontology', 'role', 'role_type', 'value')
+
     def __init__(self, value_dict=None): 
-        """Docstring."""
-        
-        if 'value' in value_dict:
-            self.value = value_dict['value']
-        if 'norm' in value_dict:
-            self.norm = value_dict['norm']
-        if 'ontology' in value_dict:
-            self.ontology = value_dict['ontology']
-        if 'role' in value_dict:
-            self.role = value_dict['role']
-        if 'role-type' in value_dict:
-            self.role_type = value_dict['role-type']
-        if 'role' in value_dict:
-            self.link_role = value_dict['link-role']
-        if 'role-type' in value_dict:
-            self.link_role_type = value_dict['link-role-type']
-        if 'value' in value_dict:
-            self.link_value = value_dict['link-value']
-        if 'value-type' in value_dict:
-            self.link_value_type = value_dict['link-value-type']
-        if 'idref' in value_dict:
-            self.link_id = value_dict['link-id']
-        if 'ent-ontology' in value_dict:
-            self.ent_ontology = value_dict['ent-ontology']
-        if 'link-ontology' in value_dict:
-            self.link_ontology = value_dict['link-ontology']
-            
-    def toJSON(self):
-        """Method to turn class into JSON object"""
-        return json.dumps(self, default=lambda o: o.__dict__, 
-            sort_keys=True, indent=4)
-    
-class NetOwl_Event:
+        """Build a link from the dict assembled by process_netowl_json."""
+
+        self.value = value_dict.get('value')
+        self.norm = value_dict.get('norm')
+        self.ontology = value_dict.get('ontology')
+        self.role = value_dict.get('role')
+        self.role_type = value_dict.get('role-type')
+        self.link_role = value_dict.get('link-role')
+        self.link_role_type = value_dict.get('link-role-type')
+        self.link_value = value_dict.get('link-value')
+        self.link_value_type = value_dict.get('link-value-type')
+        self.link_id = value_dict.get('link-id')
+        self.ent_ontology = value_dict.get('ent-ontology')
+        self.link_ontology = value_dict.get('link-ontology')
+
+class NetOwl_Event(NetOwl_Record):
     """Class object to hold events extracted by the NetOwl API"""
-    
+
+    record_type = 'event'
+
+    __slots__ = ('arg_id', 'arg_ontology', 'arg_role', 'arg_value', 'arg_value_type',
+                 'ent_ontology', 'event_id', 'event_role', 'event_value', 'event_value_type',
+                 'predicate', 'triple')
+
     def __init__(self, value_dict=None): 
-        """Docstring."""
-        
+        """Build an event from the dict assembled by process_netowl_json."""
+
         self.event_role = value_dict['event-role']
         self.event_value = value_dict['event-value']
         self.event_value_type = value_dict['event-value-type']
@@ -109,245 +190,284 @@ class NetOwl_Event:
             self.arg_ontology = value_dict['arg-ontology']
             self.triple = value_dict['triple']
         else:
+            self.arg_role = self.arg_value = self.arg_value_type = None
+            self.arg_id = self.arg_ontology = None
             self.triple = False
-            
-    def toJSON(self):
-        """Method to turn class into JSON object"""
-        return json.dumps(self, default=lambda o: o.__dict__, 
-            sort_keys=True, indent=4)
 
-class Text_Item:
+class Text_Item(NetOwl_Record):
     """Class to hold text content derived from NetOwl API"""
-    
-    
+
+    record_type = 'text'
+
+    __slots__ = ('content', 'id')
+
     def __init__(self, doc_id=None, text_content=None): 
         """Docstring."""
         self.id = doc_id
         self.content = text_content
-        
-        
-    def toJSON(self):
-        """Method to turn class into JSON object"""
-        return json.dumps(self, default=lambda o: o.__dict__, 
-            sort_keys=True, indent=4)
 
-def process_netowl_json(document_file, json_data, web_url, query_string, category):
+# Geo type and subtype of each geo-entity ontology, to allow for better symbology
+GEO_TYPES = {
+    "entity:place:city": ("placename", "city"),
+    "entity:place:country": ("placename", "country"),
+    "entity:place:province": ("placename", "province"),
+    "entity:place:continent": ("placename", "continent"),
+    "entity:numeric:coordinate:mgrs": ("coordinate", "MGRS"),
+    "entity:numeric:coordinate:latlong": ("coordinate", "latlong"),
+    "entity:address:mail": ("address", "mail"),
+    "entity:place:other": ("placename", "descriptor"),
+    "entity:place:landform": ("placename", "landform"),
+    "entity:organization:facility": ("placename", "facility"),
+    "entity:place:water": ("placename", "water"),
+    "entity:place:county": ("placename", "county"),
+}
+DEFAULT_GEO_TYPE = ("placename", "unknown")
+
+def process_netowl_json(document_file, json_data, web_url, query_string, category, geocoder=None):
+    """Return the entities, links and events NetOwl found in a document."""
     doc_entities = []
     doc_links = []
     doc_events = []
-    
+    if geocoder is None:
+        geocoder = default_geocoder()
+    # Geocode outside the process timer, which only covers building the records
+    locations = geocoder.geocode_many(mail_addresses(json_data))
+    with metrics.timer('process'):
+        records = iter_netowl_records(document_file, json_data, web_url, query_string, category, geocoder,
+                                      locations)
+        for record in tally_records(records):
+            if isinstance(record, NetOwl_Entity):
+                doc_entities.append(record)
+            elif isinstance(record, NetOwl_Link):
+                doc_links.append(record)
+            else:
+                doc_events.append(record)
+    return doc_entities, doc_links, doc_events
+
+def tally_records(records):
+    """Yield records unchanged, adding how many of each type went by to the run metrics."""
+    counts = {}
+    try:
+        for record in records:
+            counts[record.record_type] = counts.get(record.record_type, 0) + 1
+            yield record
+    finally:
+        for record_type, n in counts.items():
+            metrics.count('records_' + record_type, n)
+
+def iter_netowl_records(document_file, json_data, web_url, query_string, category, geocoder=None,
+                        locations=None):
+    """Walk a NetOwl document once, yielding entity, link and event objects.
+
+    Each entity is followed by the links it references, then come the
+    document-level links and finally the events. locations maps the mail
+    addresses to their locations when they were geocoded beforehand.
+    """
     # Open main portion of output NetOwl JSON
-    if 'document' in json_data:
-        document = json_data['document'][0]
-                    
-        # Extract source text that is embedded in NetOwl JSON and save it as a Text_Item class object
-        if 'text' in document:
-            content = document['text'][0]['content']
-                        
-            content_object = Text_Item(doc_id=document_file, text_content=content)
-                        
-        if 'entity' in document:
-            # Build entity objects
-            ents = (document['entity'])  # gets all entities in doc
-
-            # Iterates through entities in the document
-            for e in ents:
-                base_entity = {}
-
-                # gather data from each entity
-                rdfvalue = cleanup_text(e['value'])  # value (ie name)
-                rdfid = e['id']
-                rdfid = document_file.split(".")[0] + "_e_" + rdfid  # unique to each entity
-                e['id'] = rdfid
-
-                base_entity['id'] = rdfid
-
-                if 'ontology' in e:
-                    base_entity['ontology'] = e['ontology']
-                if 'value' in e:
-                    base_entity['value'] = e['value']
-                if 'norm' in e:
-                    base_entity['norm'] = e['norm']
-
-                if 'geodetic' in e:
-                    base_entity['geo_entity'] = True
-                    base_entity['lat'] = float(e['geodetic']['latitude'])
-                    base_entity['long'] = float(e['geodetic']['longitude'])
-
-                # check for addresses
-                if e['ontology'] == "entity:address:mail":
-                    address = e['value']
-                    location = geocode_address(address)  # returns x,y
-
-                    base_entity['geo_entity'] = True
-                    base_entity['lat'] = location['y']
-                    base_entity['long'] = location['x']
-                    
-                # Sets the type of the geo-entity to allow for better symbology
-
-                if 'geo_entity' in base_entity:
-                    base_entity['geo_type'] = "placename"
-                    base_entity['geo_subtype'] = "unknown"
-
-                    if e['ontology'] == "entity:place:city":
-                        base_entity['geo_type'] = "placename"
-                        base_entity['geo_subtype'] = "city"
-                    if e['ontology'] == "entity:place:country":
-                        base_entity['geo_type'] = "placename"
-                        base_entity['geo_subtype'] = "country"
-                    if e['ontology'] == "entity:place:province":
-                        base_entity['geo_type'] = "placename"
-                        base_entity['geo_subtype'] = "province"
-                    if e['ontology'] == "entity:place:continent":
-                        base_entity['geo_type'] = "placename"
-                        base_entity['geo_subtype'] = "continent"
-                    if e['ontology'] == "entity:numeric:coordinate:mgrs":
-                        base_entity['geo_type'] = "coordinate"
-                        base_entity['geo_subtype'] = "MGRS"
-                    if e['ontology'] == "entity:numeric:coordinate:latlong":
-                        base_entity['geo_type'] = "coordinate"
-                        base_entity['geo_subtype'] = "latlong"
-                    if e['ontology'] == "entity:address:mail":
-                        base_entity['geo_type'] = "address"
-                        base_entity['geo_subtype'] = "mail"
-                    if e['ontology'] == "entity:place:other":
-                        base_entity['geo_type'] = "placename"
-                        base_entity['geo_subtype'] = "descriptor"
-                    if e['ontology'] == "entity:place:landform":
-                        base_entity['geo_type'] = "placename"
-                        base_entity['geo_subtype'] = "landform"
-                    if e['ontology'] == "entity:organization:facility":
-                        base_entity['geo_type'] = "placename"
-                        base_entity['geo_subtype'] = "facility"
-                    if e['ontology'] == "entity:place:water":
-                        base_entity['geo_type'] = "placename"
-                        base_entity['geo_subtype'] = "water"
-                    if e['ontology'] == "entity:place:county":
-                        base_entity['geo_type'] = "placename"
-                        base_entity['geo_subtype'] = "county"
-                
-                if 'entity-mention' in e:
-                    em = e['entity-mention'][0]
-                    if 'head' in em:
-                        base_entity['head'] = get_head(content, int(em['head']), 255)
-                    if 'tail' in em:
-                        base_entity['tail'] = get_tail(content, int(em['tail']), 255)
-
-                base_entity['doc_link'] = web_url
-                base_entity['query'] = query_string
-                base_entity['category'] = category
-
-                # Turns entity information into a class object for storage and transformation
-                netowl_entity_object = NetOwl_Entity(base_entity)
-                doc_entities.append(netowl_entity_object)
-
-                # Returns extracted links from the entity
-                if 'link-ref' in e:
-                    base_entity['has_links'] = True
-
-                    base_link = {}
-
-                    base_link['id'] = rdfid
-
-                    if 'value' in e:
-                        base_link['value'] = e['value']
-                    if 'norm' in e:
-                        base_link['norm'] = e['norm']
-                    link_ref = e['link-ref']
-                    for link in link_ref:
-                        if 'ontology' in link:
-                            base_link['ontology'] = link['ontology']
-                        if 'role' in link:
-                            base_link['role'] = link['role']
-                        if 'role-type' in link:
-                            base_link['role-type'] = link['role-type']
-                        if 'role' in link['entity-arg'][0]:
-                            base_link['link-role'] = link['entity-arg'][0]['role']
-                        if 'role-type' in link['entity-arg'][0]:
-                            base_link['link-role-type'] = link['entity-arg'][0]['role-type']
-                        if 'value' in link['entity-arg'][0]:
-                            base_link['link-value'] = link['entity-arg'][0]['value']
-                        if 'value-type' in link['entity-arg'][0]:
-                            base_link['link-value-type'] = link['entity-arg'][0]['value-type']
-                        if 'idref' in link['entity-arg'][0]:
-                            base_link['link-id'] = document_file.split(".")[0] + "_e_" + link['entity-arg'][0]['idref']
-                        if 'ontology' in link:
-                            base_link['link-ontology'] = link['entity-arg'][0]['ontology']
-                            base_link['ent-ontology'] = e['ontology']
-
-                        netowl_link_object = NetOwl_Link(base_link)
-                        doc_links.append(netowl_link_object)
-            
-        # Determines if there are extracted links in the document
-        if 'link' in document:
-            links = (document['link'])
-            for link in links:
-                base_link = {}
-                
-                base_link['ontology'] = link['ontology']
-                entity_arg1 = link['entity-arg'][0]
-                entity_arg2 = link['entity-arg'][1]
-                
-                base_link['role'] = entity_arg1['role']
-                base_link['role-type'] = entity_arg1['role-type']
-                base_link['value'] = entity_arg1['value']
-                base_link['role'] = entity_arg1['role']
-                base_link['id'] = document_file.split(".")[0] + "_e_" + entity_arg1['idref']
-                base_link['ent-ontology'] = entity_arg1['ontology']
-                base_link['link-role'] = entity_arg2['role']
-                base_link['link-role-type'] = entity_arg2['role']
-                base_link['link-value'] = entity_arg2['value']
-                base_link['link-value-type'] = entity_arg2['value-type']
-                base_link['link-id'] = document_file.split(".")[0] + "_e_" + entity_arg2['idref']
-                base_link['link-ontology'] = entity_arg2['ontology']
-                
-                netowl_link_object = NetOwl_Link(base_link)
-                doc_links.append(netowl_link_object)
-
-        # Determines if there are extracted events in the document
-        if 'event' in document:
-            events = (document['event'])
-            for event in events:
-                base_event = {}
-                
-                event_args = event['entity-arg']
-                event_properties = event['property'][0]
-                    
-                
-                base_event['event-role'] = event_args[0]['role']
-                base_event['event-value'] = event_args[0]['value']
-                base_event['event-value-type'] = event_args[0]['value-type']
-                base_event['event-id'] = document_file.split(".")[0] + "_e_" + event_args[0]['idref']
-                base_event['ent-ontology'] = event_args[0]['ontology']
-                base_event['predicate'] = event_properties['value']
-                
-                if len(event['entity-arg']) > 1:
-                    count = 0
-                    for arg in event_args:
-                        count +=1
-                        if count == 1:
-                            pass
-                        else:
-                            arg_dict = base_event.copy()
-                            event_arg = event['entity-arg'][1]
-                            arg_dict['arg-role'] = arg['role']
-                            arg_dict['arg-value'] = arg['value']
-                            arg_dict['arg-value-type'] = arg['value-type']
-                            arg_dict['arg-id'] = document_file.split(".")[0] + "_e_" + arg['idref']
-                            arg_dict['arg-ontology'] = arg['ontology']
-                            arg_dict['triple'] = True
-                    
-                            netowl_event_object = NetOwl_Event(arg_dict)
-                            doc_events.append(netowl_event_object)
+    if 'document' not in json_data:
+        return
+    document = json_data['document'][0]
 
-                else:
-                    netowl_event_object = NetOwl_Event(base_event)
-                    doc_events.append(netowl_event_object)
-                
-        return doc_entities, doc_links, doc_events
+    # Geocode every address in the document up front, in one go
+    if locations is None:
+        if geocoder is None:
+            geocoder = default_geocoder()
+        locations = geocoder.geocode_many(mail_addresses(json_data))
+
+    # Prefix that makes NetOwl ids unique to this document
+    prefix = document_file.split(".")[0] + "_e_"
+
+    # Source text that is embedded in NetOwl JSON, used for entity context
+    content = document['text'][0]['content'] if 'text' in document else ""
+
+    for e in document.get('entity', ()):
+        yield build_entity(e, prefix, content, locations, web_url, query_string, category)
+        for link in e.get('link-ref', ()):
+            yield build_entity_link(e, link, prefix)
+
+    for link in document.get('link', ()):
+        yield build_link(link, prefix)
+
+    for event in document.get('event', ()):
+        for netowl_event_object in build_events(event, prefix):
+            yield netowl_event_object
+
+def iter_netowl_stream(json_file, document_file, web_url, query_string, category, geocoder=None,
+                       chunk_size=200, locations=None):
+    """Like iter_netowl_records, but parse a NetOwl response incrementally.
+
+    json_file is a seekable binary file holding the NetOwl JSON. Entities,
+    links and events are read one at a time with ijson, so memory stays
+    flat however large the response is; only the document text is held
+    in full, once, for entity context. Unless locations already holds
+    them, addresses are geocoded chunk_size entities at a time.
+    """
+    if geocoder is None and locations is None:
+        geocoder = default_geocoder()
+
+    # Prefix that makes NetOwl ids unique to this document
+    prefix = document_file.split(".")[0] + "_e_"
+
+    # Source text that is embedded in NetOwl JSON, used for entity context
+    content = next(iter(stream_items(json_file, 'document.item.text.item.content')), "")
+
+    chunk = []
+    for e in stream_items(json_file, 'document.item.entity.item'):
+        chunk.append(e)
+        if len(chunk) >= chunk_size:
+            for record in _entity_chunk_records(chunk, prefix, content, geocoder, web_url, query_string, category,
+                                                locations):
+                yield record
+            chunk = []
+    for record in _entity_chunk_records(chunk, prefix, content, geocoder, web_url, query_string, category,
+                                        locations):
+        yield record
+
+    for link in stream_items(json_file, 'document.item.link.item'):
+        yield build_link(link, prefix)
+
+    for event in stream_items(json_file, 'document.item.event.item'):
+        for netowl_event_object in build_events(event, prefix):
+            yield netowl_event_object
+
+def _entity_chunk_records(chunk, prefix, content, geocoder, web_url, query_string, category, locations=None):
+    if locations is None:
+        addresses = [e['value'] for e in chunk if e.get('ontology') == "entity:address:mail"]
+        locations = geocoder.geocode_many(addresses) if addresses else {}
+    for e in chunk:
+        yield build_entity(e, prefix, content, locations, web_url, query_string, category)
+        for link in e.get('link-ref', ()):
+            yield build_entity_link(e, link, prefix)
+
+def stream_items(json_file, prefix):
+    """Rewind json_file and lazily yield the JSON values found at an ijson prefix."""
+    json_file.seek(0)
+    return ijson.items(json_file, prefix, use_float=True)
+
+def stream_mail_addresses(json_file):
+    """Return the unique mail addresses in a NetOwl response file."""
+    addresses = []
+    for e in stream_items(json_file, 'document.item.entity.item'):
+        if e.get('ontology') == "entity:address:mail" and e['value'] not in addresses:
+            addresses.append(e['value'])
+    return addresses
+
+def build_entity(e, prefix, content, locations, web_url, query_string, category):
+    """Turn one NetOwl entity into a NetOwl_Entity."""
+    ontology = e.get('ontology')
+    base_entity = {'id': prefix + e['id']}  # unique to each entity
+
+    if ontology is not None:
+        base_entity['ontology'] = ontology
+    if 'value' in e:
+        base_entity['value'] = e['value']
+    if 'norm' in e:
+        base_entity['norm'] = e['norm']
+
+    if 'geodetic' in e:
+        base_entity['geo_entity'] = True
+        base_entity['lat'] = float(e['geodetic']['latitude'])
+        base_entity['long'] = float(e['geodetic']['longitude'])
+
+    # check for addresses
+    if ontology == "entity:address:mail":
+        location = locations.get(e['value'])  # returns x,y
+        if location is not None:
+            base_entity['geo_entity'] = True
+            base_entity['lat'] = location['y']
+            base_entity['long'] = location['x']
+
+    if 'geo_entity' in base_entity:
+        base_entity['geo_type'], base_entity['geo_subtype'] = GEO_TYPES.get(ontology, DEFAULT_GEO_TYPE)
+
+    if 'entity-mention' in e:
+        em = e['entity-mention'][0]
+        if 'head' in em:
+            base_entity['head'] = get_head(content, int(em['head']), 255)
+        if 'tail' in em:
+            base_entity['tail'] = get_tail(content, int(em['tail']), 255)
+
+    base_entity['doc_link'] = web_url
+    base_entity['query'] = query_string
+    base_entity['category'] = category
+    return NetOwl_Entity(base_entity)
+
+def build_entity_link(e, link, prefix):
+    """Turn a link referenced from an entity into a NetOwl_Link."""
+    base_link = {}
+    if 'value' in e:
+        base_link['value'] = e['value']
+    if 'norm' in e:
+        base_link['norm'] = e['norm']
+    if 'role' in link:
+        base_link['role'] = link['role']
+    if 'role-type' in link:
+        base_link['role-type'] = link['role-type']
+
+    entity_arg = link['entity-arg'][0]
+    if 'role' in entity_arg:
+        base_link['link-role'] = entity_arg['role']
+    if 'role-type' in entity_arg:
+        base_link['link-role-type'] = entity_arg['role-type']
+    if 'value' in entity_arg:
+        base_link['link-value'] = entity_arg['value']
+    if 'value-type' in entity_arg:
+        base_link['link-value-type'] = entity_arg['value-type']
+    if 'idref' in entity_arg:
+        base_link['link-id'] = prefix + entity_arg['idref']
+    if 'ontology' in link:
+        base_link['ontology'] = link['ontology']
+        base_link['link-ontology'] = entity_arg['ontology']
+        base_link['ent-ontology'] = e['ontology']
+    return NetOwl_Link(base_link)
+
+def build_link(link, prefix):
+    """Turn a document-level NetOwl link into a NetOwl_Link."""
+    entity_arg1 = link['entity-arg'][0]
+    entity_arg2 = link['entity-arg'][1]
+    return NetOwl_Link({
+        'ontology': link['ontology'],
+        'role': entity_arg1['role'],
+        'role-type': entity_arg1['role-type'],
+        'value': entity_arg1['value'],
+        'ent-ontology': entity_arg1['ontology'],
+        'link-role': entity_arg2['role'],
+        'link-role-type': entity_arg2['role'],
+        'link-value': entity_arg2['value'],
+        'link-value-type': entity_arg2['value-type'],
+        'link-id': prefix + entity_arg2['idref'],
+        'link-ontology': entity_arg2['ontology'],
+    })
 
-def netowl_curl(infile, outpath, outextension, netowl_key):
-    """Do James Jones code to query NetOwl API."""
+def build_events(event, prefix):
+    """Turn a NetOwl event into NetOwl_Events, one per argument after the first."""
+    event_args = event['entity-arg']
+    first = event_args[0]
+    base_event = {
+        'event-role': first['role'],
+        'event-value': first['value'],
+        'event-value-type': first['value-type'],
+        'event-id': prefix + first['idref'],
+        'ent-ontology': first['ontology'],
+        'predicate': event['property'][0]['value'],
+    }
+    if len(event_args) == 1:
+        return [NetOwl_Event(base_event)]
+
+    events = []
+    for arg in event_args[1:]:
+        # NetOwl_Event copies what it needs, so base_event can be reused
+        base_event['arg-role'] = arg['role']
+        base_event['arg-value'] = arg['value']
+        base_event['arg-value-type'] = arg['value-type']
+        base_event['arg-id'] = prefix + arg['idref']
+        base_event['arg-ontology'] = arg['ontology']
+        base_event['triple'] = True
+        events.append(NetOwl_Event(base_event))
+    return events
+
+def netowl_headers(infile, netowl_key):
+    """Build the NetOwl request headers for a document."""
     headers = {
         'accept': 'application/json',  # 'application/rdf+xml',
         'Authorization': netowl_key,
@@ -359,40 +479,323 @@ def netowl_curl(infile, outpath, outextension, netowl_key):
         headers['Content-Type'] = 'application/pdf'
     elif infile.endswith(".docx"):
         headers['Content-Type'] = 'application/msword'
+    return headers
+
+def netowl_cache_key(data, headers, params):
+    """Hash a document and the request settings that affect NetOwl's answer."""
+    digest = hashlib.sha256()
+    digest.update(headers.get('Content-Type', '').encode('utf-8'))
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    digest.update(data)
+    return digest.hexdigest()
+
+def netowl_curl(data, infile, netowl_key, session=requests, cache=None, netowl_url=NETOWL_URL):
+    """Send document bytes to the NetOwl API and return the parsed JSON.
+
+    infile is only used to pick the Content-Type (.txt, .pdf, .docx). The
+    response body is streamed straight into the JSON parser. When a
+    NetOwlCache is given it is checked before posting, and successful
+    responses are stored in it.
+    """
+    headers = netowl_headers(infile, netowl_key)
+    params = NETOWL_PARAMS
+
+    if cache is not None:
+        key = netowl_cache_key(data, headers, params)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    with metrics.timer('netowl'):
+        response = session.post(netowl_url,
+                                headers=headers, params=params, data=data,
+                                verify=False, stream=True)
+        with response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            json_data = json.load(response.raw)
+    metrics.count('netowl_bytes_sent', len(data))
+    metrics.count('netowl_bytes_received', response.raw.tell())
+
+    if cache is not None and response.status_code == 200:
+        cache.put(key, json_data)
+    return json_data
+
+def netowl_curl_stream(data, infile, netowl_key, session=requests, cache=None, spool_size=8 * 1024 * 1024,
+                       netowl_url=NETOWL_URL):
+    """Like netowl_curl, but return the response as a seekable binary file.
 
-    params = {"language": "english", "text": "", "mentions": ""}
+    The body is spooled to memory and rolls over to a temporary file once
+    it grows past spool_size, ready for iter_netowl_stream.
+    """
+    headers = netowl_headers(infile, netowl_key)
+    params = NETOWL_PARAMS
 
-    data = open(infile, 'rb').read()
-    response = requests.post('https://api.netowl.com/api/v2/_process',
-                             headers=headers, params=params, data=data,
-                             verify=False)
+    if cache is not None:
+        key = netowl_cache_key(data, headers, params)
+        cached = cache.get_bytes(key)
+        if cached is not None:
+            return io.BytesIO(cached)
 
-    r = response.text
-    outpath = outpath
-    filename = os.path.split(infile)[1]
-    if os.path.exists(outpath) is False:
-        os.mkdir(outpath, mode=0o777, )
-    outfile = os.path.join(outpath, filename + outextension)
-    open(outfile, "w", encoding="utf-8").write(r)
+    json_file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    with metrics.timer('netowl'):
+        response = session.post(netowl_url,
+                                headers=headers, params=params, data=data,
+                                verify=False, stream=True)
+        with response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, json_file)
+    metrics.count('netowl_bytes_sent', len(data))
+    metrics.count('netowl_bytes_received', json_file.tell())
+
+    if cache is not None and response.status_code == 200:
+        json_file.seek(0)
+        cache.put_stream(key, json_file)
+    json_file.seek(0)
+    return json_file
+
+def save_artifacts(directory, filename, visible_text, json_data, web_url=None, targets=None):
+    """Archive the harvested text and NetOwl JSON for a document.
+
+    json_data is either the parsed response or a binary file holding it.
+    When web_url is given, a <filename>.meta.json sidecar records it and
+    the (filename, query, category) targets so the document can be
+    reprocessed offline.
+    """
+    if os.path.exists(directory) is False:
+        os.makedirs(directory, mode=0o777, exist_ok=True)
+    text_file_path = os.path.join(directory, filename + '.txt')
+    with open(text_file_path, 'w', encoding="utf-8") as text_file:
+        text_file.write(visible_text)
+    if web_url is not None:
+        with open(os.path.join(directory, filename + '.meta.json'), 'w', encoding="utf-8") as meta_file:
+            json.dump({'url': web_url, 'targets': [list(target) for target in targets or []]}, meta_file)
+    if hasattr(json_data, 'read'):
+        json_data.seek(0)
+        with open(text_file_path + ".json", 'wb') as json_file:
+            shutil.copyfileobj(json_data, json_file)
+        return
+    with open(text_file_path + ".json", 'w', encoding="utf-8") as json_file:
+        json.dump(json_data, json_file)
+
+PRINTABLE = frozenset(string.printable)
 
 def cleanup_text(intext):
     """Function to remove funky chars."""
-    printable = set(string.printable)
-    p = ''.join(filter(lambda x: x in printable, intext))
+    p = ''.join(filter(PRINTABLE.__contains__, intext))
     g = p.replace('"', "")
     return g
 
-def geocode_address(address):
-    """Use World Geocoder to get XY for one address at a time."""
+def geocode_address(address, session=requests, url=GEOCODE_URL):
+    """Use World Geocoder to get XY for one address at a time.
+
+    Returns None when the geocoder has no candidates for the address.
+    """
     querystring = {
         "f": "json",
         "singleLine": address}
-    url = "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer/findAddressCandidates"  # noqa: E501
-    response = requests.request("GET", url, params=querystring)
-    p = response.text
-    j = json.loads(p)
-    location = j['candidates'][0]['location']  # returns first location as X, Y
-    return location
+    with metrics.timer('geocode'):
+        response = session.request("GET", url, params=querystring)
+    response.raise_for_status()
+    j = geocoder_json(response.text)
+    return first_candidate(j)
+
+def geocoder_json(body):
+    """Parse a geocoder response, raising on the errors ArcGIS reports with HTTP 200.
+
+    An invalid token (498) or an exceeded quota comes back as
+    {"error": {...}}; treating it as "no candidates" would cache the miss.
+    """
+    j = json.loads(body)
+    error = j.get('error') if isinstance(j, dict) else None
+    if error:
+        raise requests.HTTPError("Geocoder error {0}: {1}".format(error.get('code'), error.get('message')))
+    return j
+
+def first_candidate(j):
+    """Return the location of the best candidate in a geocoder response."""
+    candidates = j.get('candidates') or []
+    if not candidates:
+        return None
+    return candidates[0]['location']  # returns first location as X, Y
+
+def geocode_addresses(addresses, token, session=requests, url=GEOCODE_BATCH_URL):
+    """Use the World Geocoder batch endpoint to get XY for many addresses.
+
+    Returns a list of locations (or None) in the same order as addresses.
+    """
+    with metrics.timer('geocode'):
+        response = session.post(url, data=batch_payload(addresses, token))
+    response.raise_for_status()
+    return batch_locations(geocoder_json(response.text), len(addresses))
+
+def batch_payload(addresses, token):
+    """Return the form fields of a geocodeAddresses request."""
+    records = {"records": [{"attributes": {"OBJECTID": n, "SingleLine": address}}
+                           for n, address in enumerate(addresses)]}
+    return {
+        "f": "json",
+        "token": token,
+        "addresses": json.dumps(records)}
+
+def batch_locations(j, count):
+    """Return the locations (or None) of a geocodeAddresses response in request order."""
+    found = [None] * count
+    for candidate in j.get('locations', []):
+        n = candidate.get('attributes', {}).get('ResultID')
+        if n is not None and 0 <= n < len(found) and candidate.get('score', 0) > 0:
+            found[n] = candidate['location']
+    return found
+
+def mail_addresses(json_data):
+    """Return the unique mail addresses NetOwl found in a document."""
+    addresses = []
+    for document in json_data.get('document', [])[:1]:
+        for e in document.get('entity', []):
+            if e.get('ontology') == "entity:address:mail" and e['value'] not in addresses:
+                addresses.append(e['value'])
+    return addresses
+
+def normalize_address(address):
+    """Fold case and whitespace so equivalent addresses share a cache entry."""
+    address = re.sub(r'\s*,\s*', ', ', address.strip().lower())
+    return re.sub(r'\s+', ' ', address)
+
+class Geocoder:
+    """Cached geocoding of NetOwl mail addresses.
+
+    Lookups go through an in-memory LRU and, when a path is given, a
+    persistent SQLite store, both keyed by the normalized address. Misses
+    for a document are resolved together: with the batch geocodeAddresses
+    endpoint when a token is configured, otherwise on a pool of threads.
+    Addresses without candidates are remembered as None, in the SQLite
+    store for miss_ttl seconds only; a geocoder error is raised and nothing
+    is remembered. url is the ArcGIS GeocodeServer asked; with
+    offline=True it never is, and addresses that are not cached are left
+    without a location.
+    """
+
+    def __init__(self, session=requests, path=None, memo_size=4096, workers=8, token=None, batch_size=100,
+                 url=GEOCODE_SERVER_URL, offline=False, miss_ttl=24 * 3600):
+        self.session = session
+        self.miss_ttl = miss_ttl
+        self.offline = offline
+        self.candidates_url = url.rstrip('/') + '/findAddressCandidates'
+        self.batch_url = url.rstrip('/') + '/geocodeAddresses'
+        self.memo_size = memo_size
+        self.workers = workers
+        self.token = token
+        self.batch_size = batch_size
+        self.memo = OrderedDict()
+        self.lock = threading.Lock()
+        self.cached = 0
+        self.requested = 0
+        self.executor = None
+        self.db = None
+        if path:
+            # reprocess workers share the file: WAL lets them read while one writes, and they wait for the lock
+            self.db = sqlite3.connect(path, check_same_thread=False, timeout=60)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS geocodes (address TEXT PRIMARY KEY, x REAL, y REAL, stored REAL)")
+            columns = [row[1] for row in self.db.execute("PRAGMA table_info(geocodes)")]
+            if 'stored' not in columns:
+                # Older stores did not date their misses, which may come from geocoder errors; they expire now
+                self.db.execute("ALTER TABLE geocodes ADD COLUMN stored REAL")
+            self.db.commit()
+
+    def lookup(self, address, count=True):
+        """Return (True, location) for a cached address, else (False, None)."""
+        key = normalize_address(address)
+        with self.lock:
+            if key in self.memo:
+                self.memo.move_to_end(key)
+                self.cached += count
+                return True, self.memo[key]
+            if self.db is not None:
+                row = self.db.execute("SELECT x, y, stored FROM geocodes WHERE address = ?", (key,)).fetchone()
+                if row is not None and row[0] is None and (row[2] or 0) + self.miss_ttl < time.time():
+                    row = None
+                if row is not None:
+                    location = None if row[0] is None else {'x': row[0], 'y': row[1]}
+                    self._remember(key, location)
+                    self.cached += count
+                    return True, location
+        return False, None
+
+    def store(self, address, location):
+        """Remember the location (or None) found for an address."""
+        key = normalize_address(address)
+        with self.lock:
+            self.requested += 1
+            self._remember(key, location)
+            if self.db is not None:
+                x, y = (location['x'], location['y']) if location else (None, None)
+                self.db.execute("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?)", (key, x, y, time.time()))
+                self.db.commit()
+
+    def _remember(self, key, location):
+        self.memo[key] = location
+        self.memo.move_to_end(key)
+        while len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def geocode(self, address):
+        """Return the location for one address, or None."""
+        return self.geocode_many([address]).get(address)
+
+    def geocode_many(self, addresses):
+        """Return a dict mapping each address to its location (or None)."""
+        locations = {}
+        missing = []
+        for address in addresses:
+            hit, location = self.lookup(address)
+            if hit:
+                locations[address] = location
+            elif address not in missing:
+                missing.append(address)
+
+        if self.offline:
+            for address in missing:
+                locations[address] = None
+        elif self.token:
+            for start in range(0, len(missing), self.batch_size):
+                chunk = missing[start:start + self.batch_size]
+                for address, location in zip(chunk, geocode_addresses(chunk, self.token, self.session, self.batch_url)):
+                    self.store(address, location)
+                    locations[address] = location
+        elif missing:
+            with self.lock:
+                # Several pipeline workers may hit their first miss at once
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers)
+                executor = self.executor
+            results = executor.map(lambda address: geocode_address(address, self.session, self.candidates_url), missing)
+            for address, location in zip(missing, results):
+                self.store(address, location)
+                locations[address] = location
+        return locations
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+        if self.db is not None:
+            with self.lock:
+                self.db.close()
+
+    def report(self):
+        return "Geocoder: {0} cached, {1} requested".format(self.cached, self.requested)
+
+_default_geocoder = None
+
+def default_geocoder():
+    """Return the shared in-memory Geocoder used when none is passed in."""
+    global _default_geocoder
+    if _default_geocoder is None:
+        _default_geocoder = Geocoder()
+    return _default_geocoder
 
 def get_head(text, headpos, numchars):
     """Return text before start of entity."""
@@ -410,62 +813,1757 @@ def get_tail(text, tailpos, numchars):
     thetail = text[tailpos: wheretoend]
     return thetail
 
-def post_to_geoevent(json_data, geoevent_url):
+def post_to_geoevent(json_data, geoevent_url, session=requests):
     headers = {
         'Content-Type': 'application/json',
                 }
 
-    response = requests.post((geoevent_url), headers=headers, data=json_data)
+    with metrics.timer('geoevent'):
+        response = session.post((geoevent_url), headers=headers, data=json_data)
+    metrics.count('geoevent_bytes', len(json_data))
+    return response
   
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-q", "--query", help="Query for Google Search", required=True)
-    parser.add_argument("-m", "--max", help="Max number of results to return", required=True)
-    parser.add_argument("-d", "--directory", help="Directory to write text files harvested from the web.", required=True)
-    parser.add_argument("-c", "--category", help="Category for query.", required=True)
-    parser.add_argument("-g", "--geoevent", help="GeoEvent URL.", required=True)
-    args = parser.parse_args()
-    # to search 
-    query = args.query
+def fetch_page(url, session=requests, page_cache=None, max_bytes=MAX_PAGE_BYTES, targets=None):
+    """Download a search result and describe it with page_info.
 
-    urllib3.disable_warnings()
+    At most max_bytes of the body are read. With a PageCache the request
+    is conditional, and None is returned when the page has not changed
+    since it was last processed for every one of targets.
+    """
+    headers = page_cache.validators(url, targets)[0] if page_cache is not None else {}
+    with metrics.timer('fetch'):
+        with session.get(url, headers=headers, stream=True) as r:
+            content = read_limited(r.iter_content(64 * 1024), max_bytes)
+    metrics.count('page_bytes', len(content))
+    return page_info(url, r.status_code, content, r.headers, page_cache, targets)
 
-    netowl_key = 'netowl ff5e6185-5d63-459b-9765-4ebb905affc8'
+def analyze_document(visible_text, web_url, targets, netowl_key, *,
+                     session=requests, artifacts_dir=None, cache=None, geocoder=None, stream=False,
+                     exporter=None, ledger=None, netowl_url=NETOWL_URL):
+    """Send harvested text through NetOwl once and extract entities for every target.
 
-    count = 0
-  
-    for j in search(query, tld="com", num=int(args.max), stop=10, pause=2):
-        count +=1
-        r = requests.get(j)
-        soup = BeautifulSoup(r.content, features="lxml")
+    targets is a list of (filename, query, category) for each query that
+    found web_url; a list of (filename, entities) is returned in the same
+    order. Nothing touches the disk unless artifacts_dir is given, in
+    which case the text and NetOwl JSON are archived there. With
+    stream=True the response is parsed incrementally instead of loaded
+    whole. Every entity, link and event is also handed to exporter when
+    one is given. With a JobLedger the NetOwl response is recorded, and
+    one recorded by an earlier run is used instead of calling NetOwl.
+    """
+    filename = targets[0][0]
+    results = []
+    recorded = ledger.netowl_response(web_url) if ledger is not None else None
+    if stream:
+        if recorded is not None:
+            json_file = io.BytesIO(recorded)
+        else:
+            json_file = netowl_curl_stream(visible_text.encode('utf-8'), filename + '.txt', netowl_key, session, cache,
+                                           netowl_url=netowl_url)
+            if ledger is not None:
+                ledger.analyzed_stream(web_url, json_file)
+                json_file.seek(0)
+        with json_file:
+            if artifacts_dir:
+                save_artifacts(artifacts_dir, filename, visible_text, json_file, web_url, targets)
+            # Geocode once for every target and outside the process timer
+            locations = (geocoder or default_geocoder()).geocode_many(stream_mail_addresses(json_file))
+            for target_file, query_string, category in targets:
+                records = tally_records(iter_netowl_stream(json_file, target_file, web_url, query_string,
+                                                           category, geocoder, locations=locations))
+                if exporter is not None:
+                    records = export_records(records, exporter, query_string, category)
+                with metrics.timer('process'):
+                    entity_list = [record for record in records if isinstance(record, NetOwl_Entity)]
+                results.append((target_file, entity_list))
+        return results
+
+    if recorded is not None:
+        data = json.loads(recorded)
+    else:
+        data = netowl_curl(visible_text.encode('utf-8'), filename + '.txt', netowl_key, session, cache, netowl_url)
+        if ledger is not None:
+            ledger.analyzed(web_url, dumps_compact(data))
+    if artifacts_dir:
+        save_artifacts(artifacts_dir, filename, visible_text, data, web_url, targets)
+
+    for target_file, query_string, category in targets:
+        entity_list, links_list, events_list = process_netowl_json(
+            target_file, data, web_url, query_string, category, geocoder=geocoder)
+        if exporter is not None:
+            exporter.add(entity_list + links_list + events_list, query_string, category)
+        results.append((target_file, entity_list))
+    return results
+
+def export_records(records, exporter, query_string, category):
+    """Yield records unchanged, handing each one to exporter on the way."""
+    for record in records:
+        exporter.add((record,), query_string, category)
+        yield record
+
+def read_query_file(path):
+    """Read (query, category, max) rows from a CSV query file.
+
+    Blank lines, lines starting with # and a 'query,category,max' header
+    are skipped.
+    """
+    queries = []
+    with open(path, newline='', encoding='utf-8') as query_file:
+        for line_number, row in enumerate(csv.reader(query_file), 1):
+            row = [value.strip() for value in row]
+            if not row or not row[0] or row[0].startswith('#') or row[0].lower() == 'query':
+                continue
+            if len(row) != 3 or not row[2].isdigit():
+                raise ValueError("{0}:{1}: expected 'query,category,max'".format(path, line_number))
+            queries.append((row[0], row[1], int(row[2])))
+    return queries
+
+def search_service(search_url, query_string, num, session=requests):
+    """Return the result URLs of a search service in place of Google.
+
+    The service is sent q and num and answers with {"results": [url, ...]}.
+    """
+    response = session.get(search_url, params={'q': query_string, 'num': num})
+    response.raise_for_status()
+    return response.json().get('results', [])[:num]
+
+def collect_results(queries, pause=2, limiter=None, search_url=None):
+    """Run every search and merge the hits by URL.
+
+    Returns one document per unique URL, each with the (filename, query,
+    category) targets of every query that found it, so the page is only
+    fetched and analyzed once. pause is the delay between the result pages
+    of one search; a RateLimiter paces the searches themselves. With a
+    search_url the search_service there is asked instead of Google.
+    """
+    docs = OrderedDict()
+    hits = 0
+    for query_string, category, max_results in queries:
+        if limiter is not None:
+            limiter.acquire('search')
+        count = 0
+        with metrics.timer('search'):
+            if search_url:
+                urls = search_service(search_url, query_string, int(max_results))
+            else:
+                urls = search(query_string, tld="com", num=int(max_results), stop=10, pause=pause)
+            for url in urls:
+                count +=1
+                hits += 1
+                filename = query_string.replace(" ", "_") + str(count)
+                doc = docs.setdefault(url, {'url': url, 'targets': []})
+                doc['targets'].append((filename, query_string, category))
+        metrics.count('search_results', count)
+    if len(queries) > 1:
+        print(" {0} queries returned {1} results, {2} unique URLs".format(len(queries), hits, len(docs)))
+    return list(docs.values())
+
+def is_reportable(entity):
+    """Return True for entities that should be sent to GeoEvent."""
+    if entity.geo_entity == True:
+        if entity.geo_type == 'coordinate' or entity.geo_type == 'address' or entity.geo_subtype == 'city':
+            return True
+    return False
+
+def publish_entities(entity_list, publisher):
+    """Queue reportable entities on a GeoEventPublisher and return how many were sent."""
+    entity_count = 0
+    for entity in entity_list:
+        if is_reportable(entity):
+            publisher.publish(entity)
+            entity_count +=1
+    return entity_count
+
+# Caches
+def compress_file(body_file, chunk_size=1024 * 1024):
+    """Compress what is left of a binary file chunk by chunk, without reading it whole."""
+    compressor = zlib.compressobj()
+    chunks = []
+    for block in iter(lambda: body_file.read(chunk_size), b''):
+        chunks.append(compressor.compress(block))
+    chunks.append(compressor.flush())
+    return b''.join(chunks)
+
+class NetOwlCache:
+    """Persistent SQLite cache of NetOwl responses keyed by content hash.
+
+    Entries expire after ttl seconds, and once the stored (compressed)
+    responses grow past max_bytes the least recently used ones are
+    evicted. The cache can be shared between worker threads.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                        "key TEXT PRIMARY KEY, body BLOB, size INTEGER, created REAL, accessed REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.db.commit()
+        self.size = table_size(self.db, "responses")
+
+    def get(self, key):
+        """Return the cached response for key, or None on a miss."""
+        body = self.get_bytes(key)
+        if body is None:
+            return None
+        return json.loads(body)
+
+    def get_bytes(self, key):
+        """Return the cached response body for key, or None on a miss."""
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT body, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl and row[1] + self.ttl < now:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.db.commit()
+                self.size -= len(row[0])
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self.hits += 1
+        return zlib.decompress(row[0])
+
+    def put(self, key, json_data):
+        """Store a response and evict old entries if the cache is full."""
+        self._store(key, zlib.compress(json.dumps(json_data, separators=(',', ':')).encode('utf-8')))
+
+    def put_stream(self, key, json_file):
+        """Store a response read from a file, compressing it chunk by chunk."""
+        self._store(key, compress_file(json_file))
+
+    def _store(self, key, body):
+        now = time.time()
+        with self.lock:
+            self.size = store_row(self.db, "responses", "key", key, (key, body, len(body), now, now),
+                                  len(body), self.size, self.max_bytes)
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def report(self):
+        return "NetOwl cache: {0} hits, {1} misses".format(self.hits, self.misses)
+
+def table_size(db, table):
+    """Return the total size of the rows stored in a cache table."""
+    return db.execute("SELECT COALESCE(SUM(size), 0) FROM {0}".format(table)).fetchone()[0]
+
+def store_row(db, table, key_column, key, values, size, total, max_bytes):
+    """Insert or replace a cache row and evict old ones; returns the new total size of the table."""
+    old = db.execute("SELECT size FROM {0} WHERE {1} = ?".format(table, key_column), (key,)).fetchone()
+    db.execute("INSERT OR REPLACE INTO {0} VALUES ({1})".format(table, ", ".join("?" * len(values))), values)
+    total += size - (old[0] if old is not None else 0)
+    return evict_lru(db, table, key_column, total, max_bytes)
+
+def evict_lru(db, table, key_column, total, max_bytes):
+    """Delete the least recently accessed rows of a cache table until it fits in max_bytes.
+
+    total is the current size of the table, kept by the caller so a store
+    does not have to sum the table; the size after eviction is returned.
+    Only the oldest rows are read, walking the accessed index.
+    """
+    if total <= max_bytes:
+        return total
+    doomed = []
+    for key, size in db.execute("SELECT {0}, size FROM {1} ORDER BY accessed".format(key_column, table)):
+        if total <= max_bytes:
+            break
+        doomed.append((key,))
+        total -= size
+    db.executemany("DELETE FROM {0} WHERE {1} = ?".format(table, key_column), doomed)
+    return total
+
+def target_keys(targets):
+    """Return the (query, category) pairs of a document's (filename, query, category) targets."""
+    return {(query_string, category) for filename, query_string, category in targets}
+
+class PageCache:
+    """Persistent SQLite cache of harvested pages for conditional GETs.
+
+    For every URL it keeps the ETag, Last-Modified, a hash of the body,
+    the (compressed) body itself and the queries and categories it was
+    processed for. A page is only skipped when every target of its
+    document was processed before. Pages are only stored once GeoEvent
+    has accepted every entity of their document (see expect and sent), so
+    a page that failed part way is fetched again on the next run. The
+    least recently used pages are evicted once the stored bodies grow
+    past max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.not_modified = 0
+        self.unchanged = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS pages ("
+                        "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, digest TEXT, "
+                        "body BLOB, size INTEGER, accessed REAL, targets TEXT)")
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(pages)")]
+        if 'targets' not in columns:
+            # Caches written before targets were kept; their pages are fetched again once
+            self.db.execute("ALTER TABLE pages ADD COLUMN targets TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)")
+        self.db.commit()
+        self.size = table_size(self.db, "pages")
+
+    def _targets(self, url):
+        row = self.db.execute("SELECT digest, targets FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None or not row[1]:
+            return None, set()
+        return row[0], {tuple(target) for target in json.loads(row[1])}
 
-        soup_list = [s.extract() for s in soup(['style', 'script', '[document]', 'head', 'title'])]
-        visible_text = soup.getText()
+    def validators(self, url, targets=None):
+        """Return (conditional request headers, digest) for a cached URL.
 
-        filename = args.query.replace(" ", "_") + str(count)
-        text_file_path = os.path.join(args.directory, filename + '.txt')
-        with open(text_file_path, 'w') as text_file:
-            text_file.write(visible_text)
-            text_file.close()
+        With targets, nothing is returned unless the page was processed
+        for every one of them, so the page is fetched and processed again.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT etag, last_modified, digest FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is not None and targets is not None and not target_keys(targets) <= self._targets(url)[1]:
+                row = None
+        if row is None:
+            return {}, None
+        headers = {}
+        if row[0]:
+            headers['If-None-Match'] = row[0]
+        if row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers, row[2]
 
-        netowl_curl(text_file_path, args.directory, ".json", netowl_key)
+    def put(self, url, page, targets=()):
+        """Store a fetched page (see page_info) once its document was processed for targets."""
+        body = zlib.compress(page['content'])
+        with self.lock:
+            digest, processed = self._targets(url)
+            keys = target_keys(targets) | (processed if digest == page['digest'] else set())
+            self.size = store_row(self.db, "pages", "url", url,
+                                  (url, page.get('etag'), page.get('last_modified'), page['digest'],
+                                   body, len(body), time.time(), json.dumps(sorted(keys))),
+                                  len(body), self.size, self.max_bytes)
+            self.db.commit()
 
-        with open(text_file_path + ".json", 'rb') as json_file:
+    def expect(self, url, page, targets, count):
+        """Store a page once GeoEvent has accepted the count entities queued for its document."""
+        if not count:
+            self.put(url, page, targets)
+            return
+        with self.lock:
+            self.pending[url] = [count, page, targets]
+
+    def sent(self, batch):
+        """Record a batch GeoEvent accepted; pages whose entities are all accepted are stored."""
+        done = []
+        with self.lock:
+            for entity in batch:
+                pending = self.pending.get(entity.doc_link)
+                if pending is None:
+                    continue
+                pending[0] -= 1
+                if pending[0] <= 0:
+                    done.append((entity.doc_link,) + tuple(self.pending.pop(entity.doc_link)[1:]))
+        for url, page, targets in done:
+            self.put(url, page, targets)
+
+    def touch(self, url):
+        """Mark a cached page as recently used."""
+        with self.lock:
+            self.db.execute("UPDATE pages SET accessed = ? WHERE url = ?", (time.time(), url))
+            self.db.commit()
+
+    def skip(self, url, not_modified):
+        """Count a document skipped because its page has not changed."""
+        with self.lock:
+            if not_modified:
+                self.not_modified += 1
+            else:
+                self.unchanged += 1
+        self.touch(url)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def report(self):
+        return "Page cache: {0} unchanged documents skipped ({1} not modified, {2} same content)".format(
+            self.not_modified + self.unchanged, self.not_modified, self.unchanged)
+
+def page_info(url, status, content, headers, page_cache=None, targets=None):
+    """Describe a fetched page, or return None when page_cache says it is unchanged.
+
+    headers are the response headers; status 304 or a body whose hash
+    matches the cached one counts as unchanged, as long as the page was
+    processed for every one of the document's targets.
+    """
+    if page_cache is not None and status == 304:
+        page_cache.skip(url, not_modified=True)
+        return None
+    digest = hashlib.sha256(content).hexdigest()
+    if page_cache is not None and page_cache.validators(url, targets)[1] == digest:
+        page_cache.skip(url, not_modified=False)
+        return None
+    return {'content': content, 'digest': digest, 'charset': content_charset(headers),
+            'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+
+# Job ledger
+class JobLedger:
+    """Persistent SQLite record of how far every harvested URL got.
+
+    A URL moves through three stages: fetched (its visible text is kept),
+    analyzed (the NetOwl response is kept too) and published (every
+    reportable entity was accepted by GeoEvent; the stored text and
+    response are dropped). A published URL remembers the queries and
+    categories it was published for. plan() makes a rerun skip URLs
+    published for every query that found them, start over on URLs found
+    by a new query and resume the others after their last completed
+    stage. Entities are
+    remembered by a hash of their content once GeoEvent has accepted
+    them, so a rerun only posts entities it has not seen.
+    """
+
+    STAGES = ('fetched', 'analyzed', 'published')
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.queued = set()
+        self.targets = {}
+        self.skipped = 0
+        self.rerun = 0
+        self.resumed = dict.fromkeys(self.STAGES[:2], 0)
+        self.duplicates = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                        "url TEXT PRIMARY KEY, stage TEXT, text BLOB, netowl BLOB, updated REAL, targets TEXT)")
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(jobs)")]
+        if 'targets' not in columns:
+            # Ledgers written before targets were kept; their URLs are run again, without reposting
+            self.db.execute("ALTER TABLE jobs ADD COLUMN targets TEXT")
+        self.db.execute("CREATE TABLE IF NOT EXISTS published (entity TEXT PRIMARY KEY, url TEXT, published REAL)")
+        self.db.commit()
+
+    @staticmethod
+    def entity_key(entity):
+        """Hash an entity's content; its id depends on the search rank, so it is left out.
+
+        The serialization is fixed, not dumps_compact, whose bytes depend on
+        whether orjson is installed, so a ledger keeps working across
+        environments.
+        """
+        values = entity.to_dict()
+        values.pop('id', None)
+        return hashlib.sha256(json.dumps(values, sort_keys=True, ensure_ascii=False,
+                                         separators=(',', ':')).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def legacy_entity_key(entity):
+        """Hash the way ledgers written before entity_key was fixed did, in this environment."""
+        values = entity.to_dict()
+        values.pop('id', None)
+        return hashlib.sha256(dumps_compact(values)).hexdigest()
+
+    def plan(self, docs):
+        """Return the documents that still need work, resuming each after its last stage."""
+        remaining = []
+        with self.lock:
+            for doc in docs:
+                row = self.db.execute("SELECT stage, text, targets FROM jobs WHERE url = ?",
+                                      (doc['url'],)).fetchone()
+                if row is None:
+                    remaining.append(doc)
+                    continue
+                stage, text, published = row
+                if stage == 'published':
+                    if target_keys(doc['targets']) <= {tuple(target) for target in json.loads(published or '[]')}:
+                        self.skipped += 1
+                    else:
+                        # A query that did not find the URL before; entities already sent are not posted again
+                        self.rerun += 1
+                        remaining.append(doc)
+                    continue
+                doc['text'] = zlib.decompress(text).decode('utf-8')
+                self.resumed[stage] += 1
+                remaining.append(doc)
+        return remaining
+
+    def _set_stage(self, url, stage, **blobs):
+        columns = ''.join(", {0} = ?".format(name) for name in blobs)
+        self.db.execute("INSERT OR IGNORE INTO jobs (url) VALUES (?)", (url,))
+        self.db.execute("UPDATE jobs SET stage = ?, updated = ?" + columns + " WHERE url = ?",
+                        (stage, time.time()) + tuple(blobs.values()) + (url,))
+        self.db.commit()
+
+    def fetched(self, url, visible_text):
+        with self.lock:
+            self._set_stage(url, 'fetched', text=zlib.compress(visible_text.encode('utf-8')))
+
+    def analyzed(self, url, body):
+        """Record the raw NetOwl response for a URL."""
+        self._analyzed(url, zlib.compress(body))
+
+    def analyzed_stream(self, url, json_file):
+        """Record a NetOwl response read from a binary file, compressing it chunk by chunk."""
+        self._analyzed(url, compress_file(json_file))
+
+    def _analyzed(self, url, compressed):
+        with self.lock:
+            self._set_stage(url, 'analyzed', netowl=compressed)
+
+    def netowl_response(self, url):
+        """Return the NetOwl response recorded for a URL, or None."""
+        with self.lock:
+            row = self.db.execute("SELECT netowl FROM jobs WHERE url = ?", (url,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return zlib.decompress(row[0])
+
+    def unseen(self, entities):
+        """Return the entities GeoEvent has not accepted yet and that are not already queued."""
+        fresh = []
+        with self.lock:
+            for entity in entities:
+                key = self.entity_key(entity)
+                if key in self.queued or self.db.execute(
+                        "SELECT 1 FROM published WHERE entity IN (?, ?)",
+                        (key, self.legacy_entity_key(entity))).fetchone() is not None:
+                    self.duplicates += 1
+                    continue
+                self.queued.add(key)
+                fresh.append(entity)
+        return fresh
+
+    def expect(self, url, count, targets=()):
+        """Note how many entities of a URL were queued for GeoEvent; with none it is published already.
+
+        targets are the document's (filename, query, category) targets it
+        is published for.
+        """
+        with self.lock:
+            self.targets[url] = self.targets.get(url, set()) | target_keys(targets)
+            if count:
+                self.pending[url] = self.pending.get(url, 0) + count
+            elif url not in self.pending:
+                self._publish(url)
+
+    def _publish(self, url):
+        row = self.db.execute("SELECT targets FROM jobs WHERE url = ?", (url,)).fetchone()
+        published = {tuple(target) for target in json.loads(row[0])} if row is not None and row[0] else set()
+        published |= self.targets.pop(url, set())
+        self._set_stage(url, 'published', text=None, netowl=None, targets=json.dumps(sorted(published)))
+
+    def sent(self, batch):
+        """Record a batch GeoEvent accepted; a URL is published once all its entities are."""
+        now = time.time()
+        with self.lock:
+            for entity in batch:
+                self.db.execute("INSERT OR IGNORE INTO published VALUES (?, ?, ?)",
+                                (self.entity_key(entity), entity.doc_link, now))
+                left = self.pending.get(entity.doc_link)
+                if left is None:
+                    continue
+                if left > 1:
+                    self.pending[entity.doc_link] = left - 1
+                else:
+                    del self.pending[entity.doc_link]
+                    self._publish(entity.doc_link)
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def report(self):
+        return ("Ledger: {0} published documents skipped, {1} run again for new queries, {2} resumed after fetch, "
+                "{3} after NetOwl, {4} entities already sent to GeoEvent skipped").format(
+                    self.skipped, self.rerun, self.resumed['fetched'], self.resumed['analyzed'], self.duplicates)
+
+def on_sent_callback(*trackers):
+    """Return an on_sent callback handing accepted batches to every tracker given (a JobLedger, a PageCache)."""
+    trackers = [tracker for tracker in trackers if tracker is not None]
+    if not trackers:
+        return None
+
+    def on_sent(batch):
+        for tracker in trackers:
+            tracker.sent(batch)
+    return on_sent
+
+# Rate limiting
+class TokenBucket:
+    """Token bucket allowing rate requests per second with bursts of up to burst.
+
+    A rate of None (or 0) never limits. Callers reserve a token and are
+    told how long to wait for it, so the same bucket serves threads and
+    the event loop. throttle() blocks the bucket for a while and halves
+    its rate; every success afterwards wins back a tenth of the
+    configured rate until it is restored.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.max_rate = rate or None
+        self.rate = self.max_rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.strikes = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.rate:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+    def throttle(self, delay):
+        """Stop handing out tokens for delay seconds and slow down."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self.strikes += 1
+            if self.rate:
+                self.rate = max(self.max_rate / 8, self.rate / 2)
+
+    def succeed(self):
+        with self.lock:
+            self.strikes = 0
+            if self.rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+class RateLimiter:
+    """Central scheduler pacing every outbound request with a token bucket per service.
+
+    routes maps a service name to the URL prefix of its endpoint; any other
+    URL belongs to 'pages'. rates maps a service to (rate, burst). Pages
+    get a bucket per host with the 'pages' rate, so one slow or throttling
+    site does not hold back the others. A 429 or 5xx response blocks the
+    service (or the page host) for its Retry-After, or for an exponential
+    backoff capped at max_backoff, before the request is retried.
+    """
+
+    def __init__(self, rates=None, routes=None, backoff=0.5, max_backoff=60):
+        self.rates = rates or {}
+        self.routes = dict(routes or {})
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.buckets = {service: TokenBucket(*self.rates.get(service, (None, None))) for service in SERVICES}
+        self.stats = {service: {'requests': 0, 'throttled': 0, 'waited': 0.0} for service in SERVICES}
+
+    def service(self, url):
+        """Return the name of the service a URL belongs to."""
+        for service, prefix in self.routes.items():
+            if prefix and url.startswith(prefix):
+                return service
+        return 'pages'
+
+    def _bucket(self, service, host):
+        if service != 'pages' or not host:
+            return self.buckets[service]
+        with self.lock:
+            bucket = self.buckets.get((service, host))
+            if bucket is None:
+                bucket = self.buckets[(service, host)] = TokenBucket(*self.rates.get(service, (None, None)))
+            return bucket
+
+    def _reserve(self, service, host):
+        wait = self._bucket(service, host).reserve()
+        with self.lock:
+            stats = self.stats[service]
+            stats['requests'] += 1
+            stats['waited'] += wait
+        return wait
+
+    def acquire(self, service, host=None):
+        """Block until the service (for pages, the page host) may be called."""
+        wait = self._reserve(service, host)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, service, host=None):
+        """Wait on the event loop until the service (for pages, the page host) may be called."""
+        wait = self._reserve(service, host)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def feedback(self, service, status, headers, host=None):
+        """Adapt to a response: back off on 429/5xx, recover on success."""
+        bucket = self._bucket(service, host)
+        if status in RETRY_STATUSES:
+            delay = retry_after(headers)
+            if delay is None:
+                delay = self.backoff * (2 ** bucket.strikes)
+            bucket.throttle(min(delay, self.max_backoff))
+            with self.lock:
+                self.stats[service]['throttled'] += 1
+        elif status < 400:
+            bucket.succeed()
+
+    def report(self):
+        lines = []
+        for service in SERVICES:
+            stats = self.stats[service]
+            if stats['requests']:
+                lines.append(" {0}: {1} requests, {2} throttled, {3:.1f} s waiting".format(
+                    service, stats['requests'], stats['throttled'], stats['waited']))
+        return "Rate limits:\n" + "\n".join(lines) if lines else "Rate limits: no requests"
+
+def retry_after(headers):
+    """Return the seconds asked for by a Retry-After header, or None."""
+    value = headers.get('Retry-After') if headers is not None else None
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+def parse_rate(value):
+    """Parse a SERVICE=RATE[:BURST] command line option."""
+    service, _, limit = value.partition('=')
+    rate, _, burst = limit.partition(':')
+    try:
+        rate = float(rate)
+        burst = float(burst) if burst else None
+    except ValueError:
+        rate = None
+    if service not in SERVICES or not rate or rate < 0:
+        raise argparse.ArgumentTypeError(
+            "expected SERVICE=RATE[:BURST] with SERVICE one of {0}".format(', '.join(SERVICES)))
+    return service, rate, burst
+
+# HTTP clients
+class HarvestSession(requests.Session):
+    """Connection-pooled requests session with a default timeout and retries.
+
+    Every request goes through a RateLimiter first. Responses with a
+    retryable status are fed back to it and retried once it allows;
+    connection errors are retried by urllib3 with exponential backoff.
+    """
+
+    def __init__(self, pool_size=10, timeout=60, retries=3, backoff=0.5, limiter=None):
+        super().__init__()
+        self.timeout = timeout
+        self.retries = retries
+        self.limiter = limiter if limiter is not None else RateLimiter(backoff=backoff)
+        retry = urllib3.util.Retry(total=retries, backoff_factor=backoff,
+                                   status_forcelist=(), respect_retry_after_header=False,
+                                   allowed_methods=None, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        service = self.limiter.service(url)
+        host = urlsplit(url).hostname
+        attempt = 0
+        while True:
+            self.limiter.acquire(service, host)
+            response = super().request(method, url, **kwargs)
+            self.limiter.feedback(service, response.status_code, response.headers, host)
+            if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                return response
+            response.close()
+            attempt += 1
+
+class AsyncEngine:
+    """Single shared aiohttp client used for every outbound request.
+
+    Connections are pooled and kept alive across requests, the number of
+    simultaneous connections per host is capped, and failed requests are
+    retried with exponential backoff. Use as an async context manager.
+    """
+
+    def __init__(self, limit=100, per_host=8, timeout=60, retries=3, backoff=0.5, keepalive=30, limiter=None):
+        if aiohttp is None:
+            raise RuntimeError("The async engine requires the 'aiohttp' package")
+        self.limiter = limiter if limiter is not None else RateLimiter(backoff=backoff)
+        self.limit = limit
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.keepalive = keepalive
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.per_host,
+                                         keepalive_timeout=self.keepalive, ssl=False)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def request(self, method, url, max_bytes=None, spool_size=None, **kwargs):
+        """Send a request and return (status, body, headers) once it succeeds or retries run out.
+
+        Requests are paced by the RateLimiter, which also decides how long
+        to back off after a retryable status. When max_bytes is given,
+        reading the body stops after that many bytes. With spool_size the
+        body is copied chunk by chunk into a rewound SpooledTemporaryFile
+        that rolls over to disk past spool_size, and that file is returned.
+        """
+        service = self.limiter.service(url)
+        host = urlsplit(url).hostname
+        attempt = 0
+        while True:
+            await self.limiter.acquire_async(service, host)
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    if spool_size:
+                        body = await self._spool(response.content, spool_size)
+                    elif max_bytes:
+                        body = await self._read_limited(response.content, max_bytes)
+                    else:
+                        body = await response.read()
+                    status = response.status
+                    headers = response.headers
+                self.limiter.feedback(service, status, headers, host)
+                if status not in RETRY_STATUSES or attempt >= self.retries:
+                    return status, body, headers
+                if spool_size:
+                    body.close()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    raise
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    @staticmethod
+    async def _spool(content, spool_size):
+        body = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        while True:
+            chunk = await content.read(64 * 1024)
+            if not chunk:
+                break
+            body.write(chunk)
+        body.seek(0)
+        return body
+
+    @staticmethod
+    async def _read_limited(content, max_bytes):
+        body = bytearray()
+        while len(body) < max_bytes:
+            chunk = await content.read(64 * 1024)
+            if not chunk:
+                break
+            body += chunk
+        return bytes(body[:max_bytes])
+
+async def async_fetch_page(engine, url, page_cache=None, max_bytes=MAX_PAGE_BYTES, targets=None):
+    """Download a search result; see fetch_page."""
+    headers = page_cache.validators(url, targets)[0] if page_cache is not None else {}
+    with metrics.timer('fetch'):
+        status, body, response_headers = await engine.request("GET", url, max_bytes=max_bytes, headers=headers)
+    metrics.count('page_bytes', len(body))
+    return page_info(url, status, body, response_headers, page_cache, targets)
+
+async def async_netowl_curl(engine, filename, data, netowl_key, cache=None, stream=False, netowl_url=NETOWL_URL,
+                            spool_size=8 * 1024 * 1024):
+    """Send a document to NetOwl and return the parsed JSON response.
+
+    With stream=True the raw response is returned as a binary file for
+    iter_netowl_stream instead, spooled like netowl_curl_stream does.
+    """
+    headers = netowl_headers(filename, netowl_key)
+    if cache is not None:
+        key = netowl_cache_key(data, headers, NETOWL_PARAMS)
+        cached = cache.get_bytes(key)
+        if cached is not None:
+            return io.BytesIO(cached) if stream else json.loads(cached)
+
+    if stream:
+        with metrics.timer('netowl'):
+            status, json_file, response_headers = await engine.request(
+                "POST", netowl_url, spool_size=spool_size, headers=headers, params=NETOWL_PARAMS, data=data)
+        metrics.count('netowl_bytes_sent', len(data))
+        metrics.count('netowl_bytes_received', json_file.seek(0, io.SEEK_END))
+        json_file.seek(0)
+        if status >= 400:
+            json_file.close()
+            raise requests.HTTPError("NetOwl returned HTTP {0}".format(status))
+        if cache is not None and status == 200:
+            cache.put_stream(key, json_file)
+            json_file.seek(0)
+        return json_file
+
+    with metrics.timer('netowl'):
+        status, body, response_headers = await engine.request("POST", netowl_url, headers=headers,
+                                                              params=NETOWL_PARAMS, data=data)
+    metrics.count('netowl_bytes_sent', len(data))
+    metrics.count('netowl_bytes_received', len(body))
+    if status >= 400:
+        raise requests.HTTPError("NetOwl returned HTTP {0}".format(status))
+    if cache is not None and status == 200:
+        cache.put_stream(key, io.BytesIO(body))
+    return json.loads(body)
+
+async def async_geocode_address(engine, address, url=GEOCODE_URL):
+    """Use World Geocoder to get XY for one address."""
+    querystring = {
+        "f": "json",
+        "singleLine": address}
+    with metrics.timer('geocode'):
+        status, body, headers = await engine.request("GET", url, params=querystring)
+    if status >= 400:
+        raise requests.HTTPError("Geocoder returned HTTP {0}".format(status))
+    j = geocoder_json(body)
+    return first_candidate(j)
+
+async def async_geocode_addresses(engine, addresses, token, url=GEOCODE_BATCH_URL):
+    """Use the World Geocoder batch endpoint; see geocode_addresses."""
+    with metrics.timer('geocode'):
+        status, body, headers = await engine.request("POST", url, data=batch_payload(addresses, token))
+    if status >= 400:
+        raise requests.HTTPError("Geocoder returned HTTP {0}".format(status))
+    return batch_locations(geocoder_json(body), len(addresses))
+
+async def async_geocode_many(engine, geocoder, addresses):
+    """Geocode the addresses the Geocoder has not seen yet, all at once.
+
+    With a token the misses go to the batch endpoint, batch_size at a time.
+    """
+    missing = [address for address in addresses if not geocoder.lookup(address, count=False)[0]]
+    if geocoder.token:
+        chunks = [missing[start:start + geocoder.batch_size] for start in range(0, len(missing), geocoder.batch_size)]
+        results = await asyncio.gather(*(async_geocode_addresses(engine, chunk, geocoder.token, geocoder.batch_url)
+                                         for chunk in chunks))
+        locations = [location for chunk_locations in results for location in chunk_locations]
+    else:
+        locations = await asyncio.gather(*(async_geocode_address(engine, a, geocoder.candidates_url)
+                                           for a in missing))
+    for address, location in zip(missing, locations):
+        geocoder.store(address, location)
+
+async def async_post_to_geoevent(engine, json_data, geoevent_url):
+    headers = {
+        'Content-Type': 'application/json',
+                }
+    with metrics.timer('geoevent'):
+        status, body, response_headers = await engine.request("POST", geoevent_url, headers=headers, data=json_data)
+    metrics.count('geoevent_bytes', len(json_data))
+    return status
+
+async def harvest_async(docs, publisher, netowl_key, engine, *, concurrency=100,
+                        artifacts_dir=None, cache=None, geocoder=None, stream=False, page_cache=None,
+                        parser='auto', extract_pool=None, max_page_bytes=MAX_PAGE_BYTES, exporter=None,
+                        requeue=0, ledger=None, netowl_url=NETOWL_URL):
+    """Run every document through fetch, NetOwl and GeoEvent on one event loop.
+
+    With an extract_pool (a ProcessPoolExecutor) HTML extraction runs in
+    worker processes instead of on the event loop. Every record is also
+    handed to exporter when one is given. Documents that fail at NetOwl or
+    the geocoder are retried from there after the pass, up to requeue
+    times. A JobLedger records progress as in run_threaded; the publisher
+    and a PageCache must hear of accepted batches through the publisher's
+    on_sent (see on_sent_callback).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    if geocoder is None:
+        geocoder = default_geocoder()
+
+    retry_queue = []
+    in_flight = 0
+
+    async def handle(doc):
+        nonlocal in_flight
+        async with semaphore:
+            in_flight += 1
+            metrics.gauge('in_flight', in_flight)
+            try:
+                await process(doc)
+            finally:
+                in_flight -= 1
+
+    async def process(doc):
+        filename = doc['targets'][0][0]
+        try:
+            doc.setdefault('started', time.perf_counter())
+            if 'text' not in doc:
+                page = await async_fetch_page(engine, doc['url'], page_cache, max_page_bytes, doc['targets'])
+                if page is None:
+                    return
+                with metrics.timer('extract'):
+                    if extract_pool is not None:
+                        doc['text'] = await asyncio.get_running_loop().run_in_executor(
+                            extract_pool, extract_visible_text, page['content'], parser, page['charset'])
+                    else:
+                        doc['text'] = extract_visible_text(page['content'], parser, page['charset'])
+                if page_cache is not None:
+                    doc['page'] = page
+                if ledger is not None:
+                    ledger.fetched(doc['url'], doc['text'])
+        except Exception as err:
+            print(" Failed to process {0}: {1}".format(doc['url'], err))
+            return
+        visible_text = doc['text']
+        try:
+            recorded = ledger.netowl_response(doc['url']) if ledger is not None else None
+            if recorded is not None:
+                data = io.BytesIO(recorded) if stream else json.loads(recorded)
+            else:
+                data = await async_netowl_curl(engine, filename + '.txt',
+                                               visible_text.encode('utf-8'), netowl_key, cache, stream, netowl_url)
+                if ledger is not None and stream:
+                    ledger.analyzed_stream(doc['url'], data)
+                    data.seek(0)
+                elif ledger is not None:
+                    ledger.analyzed(doc['url'], dumps_compact(data))
+            if artifacts_dir:
+                save_artifacts(artifacts_dir, filename, visible_text, data, doc['url'], doc['targets'])
+
+            # Resolve every address in the document before walking its entities
+            if stream:
+                await async_geocode_many(engine, geocoder, stream_mail_addresses(data))
+            else:
+                await async_geocode_many(engine, geocoder, mail_addresses(data))
+
+            # Fan the document out to every query that found it
+            published = []
+            for target_file, query_string, category in doc['targets']:
+                if stream:
+                    records = iter_netowl_stream(data, target_file, doc['url'], query_string, category, geocoder)
+                else:
+                    records = iter_netowl_records(target_file, data, doc['url'], query_string, category, geocoder)
+                records = tally_records(records)
+                if exporter is not None:
+                    records = export_records(records, exporter, query_string, category)
+
+                with metrics.timer('process'):
+                    reportable = [record for record in records
+                                  if isinstance(record, NetOwl_Entity) and is_reportable(record)]
+                if ledger is not None:
+                    reportable = ledger.unseen(reportable)
+                published.append((target_file, reportable))
+            if stream:
+                data.close()
+
+            queued = sum(len(reportable) for target_file, reportable in published)
+            if ledger is not None:
+                ledger.expect(doc['url'], queued, doc['targets'])
+            if page_cache is not None and 'page' in doc:
+                page_cache.expect(doc['url'], doc.pop('page'), doc['targets'], queued)
+            for target_file, reportable in published:
+                for entity in reportable:
+                    await publisher.publish(entity)
+                metrics.count('entities_queued', len(reportable))
+                print(" Successfully processed {0} entities in {1}\n"
+                      "-------------------------------------------------------".format(str(len(reportable)), target_file + '.json'))
+            metrics.count('documents')
+            metrics.observe('document', time.perf_counter() - doc['started'])
+            del doc['text']
+        except Exception as err:
+            if doc.get('requeued', 0) >= requeue:
+                print(" Failed to process {0}: {1}".format(doc['url'], err))
+                return
+            doc['requeued'] = doc.get('requeued', 0) + 1
+            print(" Deferred {0} for another pass: {1}".format(doc['url'], err))
+            retry_queue.append(doc)
+
+    async with engine:
+        publisher.start()
+        try:
+            pending = docs
+            while pending:
+                await asyncio.gather(*(handle(doc) for doc in pending))
+                pending, retry_queue[:] = list(retry_queue), []
+        finally:
+            await publisher.close()
+
+# GeoEvent publishing
+class BatchStats:
+    """Latency and throughput of the batches sent to GeoEvent."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.batches = 0
+        self.entities = 0
+        self.failed = 0
+        self.latencies = []
+
+    def record(self, count, seconds, ok):
+        with self.lock:
+            if ok:
+                self.batches += 1
+                self.entities += count
+                self.latencies.append(seconds)
+            else:
+                self.failed += 1
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        latencies = sorted(self.latencies)
+        if latencies:
+            mean = sum(latencies) / len(latencies)
+            worst = latencies[-1]
+        else:
+            mean = worst = 0.0
+        return ("GeoEvent: {0} entities in {1} batches ({2} failed), "
+                "batch latency avg {3:.0f} ms / max {4:.0f} ms, {5:.1f} entities/s").format(
+                    self.entities, self.batches, self.failed, mean * 1000, worst * 1000,
+                    self.entities / elapsed)
+
+class GeoEventPublisher:
+    """Buffer entities and post them to GeoEvent as compact JSON arrays.
+
+    A background thread flushes the buffer once batch_size entities are
+    waiting or flush_interval seconds have passed since the first one
+    arrived. Failed posts are retried by the session (a HarvestSession
+    backs off through its RateLimiter), not again here. At most
+    max_pending entities are buffered, so when the receiver slows down
+    publish() blocks the callers instead of letting the backlog grow.
+    on_sent is called with every batch GeoEvent accepted.
+    """
+
+    _CLOSE = object()
+
+    def __init__(self, geoevent_url, session=requests, batch_size=100, flush_interval=1.0,
+                 max_pending=1000, on_sent=None):
+        self.geoevent_url = geoevent_url
+        self.on_sent = on_sent
+        self.session = session
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.stats = BatchStats()
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, name="geoevent-publisher", daemon=True)
+        self.thread.start()
+
+    def publish(self, entity):
+        """Queue one entity, blocking while the buffer is full."""
+        self.queue.put(entity)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self._CLOSE:
+                if batch:
+                    self._send(batch)
+                return
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._send(batch)
+                batch = []
+
+    def _send(self, batch):
+        metrics.gauge('geoevent_pending', self.queue.qsize())
+        data = dumps_compact(batch)
+        started = time.monotonic()
+        try:
+            response = post_to_geoevent(data, self.geoevent_url, self.session)
+            if response.status_code < 400:
+                self.stats.record(len(batch), time.monotonic() - started, True)
+                metrics.count('entities_published', len(batch))
+                if self.on_sent is not None:
+                    self.on_sent(batch)
+                return
+            error = "HTTP {0}".format(response.status_code)
+        except requests.RequestException as err:
+            error = err
+        self.stats.record(len(batch), time.monotonic() - started, False)
+        print(" Failed to post {0} entities to GeoEvent: {1}".format(len(batch), error))
+
+    def close(self):
+        """Flush whatever is buffered and stop the background thread."""
+        self.queue.put(self._CLOSE)
+        self.thread.join()
+
+    def report(self):
+        return self.stats.report()
+
+class AsyncGeoEventPublisher:
+    """GeoEventPublisher for the async engine, flushing from an asyncio task."""
+
+    _CLOSE = object()
+
+    def __init__(self, engine, geoevent_url, batch_size=100, flush_interval=1.0, max_pending=1000, on_sent=None):
+        self.engine = engine
+        self.on_sent = on_sent
+        self.geoevent_url = geoevent_url
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.stats = BatchStats()
+        self.queue = None
+        self.task = None
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.task = asyncio.ensure_future(self._run())
+
+    async def publish(self, entity):
+        """Queue one entity, waiting while the buffer is full."""
+        await self.queue.put(entity)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        batch = []
+        deadline = None
+        while True:
+            try:
+                if batch:
+                    item = await asyncio.wait_for(self.queue.get(), max(0.0, deadline - loop.time()))
+                else:
+                    item = await self.queue.get()
+            except asyncio.TimeoutError:
+                item = None
+            if item is self._CLOSE:
+                if batch:
+                    await self._send(batch)
+                return
+            if item is not None:
+                if not batch:
+                    deadline = loop.time() + self.flush_interval
+                batch.append(item)
+            if batch and (len(batch) >= self.batch_size or loop.time() >= deadline):
+                await self._send(batch)
+                batch = []
+
+    async def _send(self, batch):
+        # AsyncEngine.request already retries with backoff
+        metrics.gauge('geoevent_pending', self.queue.qsize())
+        data = dumps_compact(batch)
+        started = time.monotonic()
+        try:
+            status = await async_post_to_geoevent(self.engine, data, self.geoevent_url)
+            error = None if status < 400 else "HTTP {0}".format(status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            error = err
+        self.stats.record(len(batch), time.monotonic() - started, error is None)
+        if error is None:
+            metrics.count('entities_published', len(batch))
+        if error is None and self.on_sent is not None:
+            self.on_sent(batch)
+        if error is not None:
+            print(" Failed to post {0} entities to GeoEvent: {1}".format(len(batch), error))
+
+    async def close(self):
+        """Flush whatever is buffered and stop the flushing task."""
+        await self.queue.put(self._CLOSE)
+        await self.task
+
+    def report(self):
+        return self.stats.report()
+
+# Concurrent pipeline
+class Pipeline:
+    """Chain of worker pools connected by bounded queues.
+
+    Every stage is a function that takes the item produced by the previous
+    stage and returns the item for the next one (or None to drop it). Each
+    stage runs in its own pool of threads, and the queues between stages
+    are bounded so a slow stage blocks its producers instead of letting
+    pending documents pile up in memory.
+    """
+
+    _DONE = object()
+
+    def __init__(self, queue_size=8):
+        self.queue_size = queue_size
+        self.stages = []
+
+    def add_stage(self, name, func, workers=1):
+        """Append a stage running func in a pool of workers threads."""
+        self.stages.append((name, func, max(1, int(workers))))
+        return self
+
+    def _worker(self, name, func, inbox, outbox, state):
+        with metrics.thread_profile():
+            self._work(name, func, inbox, outbox, state)
+
+    def _work(self, name, func, inbox, outbox, state):
+        while True:
+            item = inbox.get()
+            if item is self._DONE:
+                # Let sibling workers see the marker too, and close the
+                # downstream queue once the last worker of the stage exits
+                inbox.put(self._DONE)
+                with state['lock']:
+                    state['running'] -= 1
+                    last = state['running'] == 0
+                if last and outbox is not None:
+                    outbox.put(self._DONE)
+                return
+            metrics.gauge('queue_' + name, inbox.qsize())
+            try:
+                result = func(item)
+            except Exception as err:
+                print(" Stage '{0}' failed: {1}".format(name, err))
+                continue
+            if result is not None and outbox is not None:
+                outbox.put(result)
+
+    def run(self, items):
+        """Feed items through every stage and block until all are drained."""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = []
+        for index, (name, func, workers) in enumerate(self.stages):
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            state = {'lock': threading.Lock(), 'running': workers}
+            for n in range(workers):
+                t = threading.Thread(target=self._worker, name="{0}-{1}".format(name, n),
+                                     args=(name, func, inbox, outbox, state), daemon=True)
+                t.start()
+                threads.append(t)
+
+        try:
+            for item in items:
+                queues[0].put(item)
+        finally:
+            queues[0].put(self._DONE)
+            for t in threads:
+                t.join()
+
+def run_threaded(docs, args, netowl_key, *, artifacts_dir=None, cache=None, geocoder=None, page_cache=None,
+                 extract_pool=None, exporter=None, limiter=None, ledger=None):
+    """Run documents through the threaded fetch/extract/NetOwl/GeoEvent pipeline.
+
+    A document that fails at NetOwl or the geocoder is put on a retry
+    queue and run through the pipeline again, from the NetOwl stage, once
+    the first pass is done (at most args.requeue times). With a JobLedger
+    every stage a document completes is recorded, and only entities
+    GeoEvent has not accepted before are posted.
+    """
+    session = HarvestSession(pool_size=max(args.workers, args.per_host),
+                             timeout=args.timeout, retries=args.retries, limiter=limiter)
+    if geocoder is not None:
+        geocoder.session = session
+    publisher = GeoEventPublisher(args.geoevent, session, batch_size=args.batch_size,
+                                  flush_interval=args.flush_interval, max_pending=args.max_pending,
+                                  on_sent=on_sent_callback(ledger, page_cache))
+
+    retry_queue = queue.Queue()
+
+    def fetch(doc):
+        doc.setdefault('started', time.perf_counter())
+        if 'text' in doc:
+            return doc
+        doc['page'] = fetch_page(doc['url'], session, page_cache, int(args.max_page_bytes * 1024 * 1024),
+                                 doc['targets'])
+        if doc['page'] is None:
+            return None
+        return doc
+
+    def extract(doc):
+        if 'text' in doc:
+            return doc
+        with metrics.timer('extract'):
+            if extract_pool is not None:
+                doc['text'] = extract_pool.submit(extract_visible_text, doc['page']['content'], args.parser,
+                                                  doc['page']['charset']).result()
+            else:
+                doc['text'] = extract_visible_text(doc['page']['content'], args.parser, doc['page']['charset'])
+        if page_cache is None:
+            del doc['page']
+        if ledger is not None:
+            ledger.fetched(doc['url'], doc['text'])
+        return doc
+
+    def analyze(doc):
+        try:
+            doc['results'] = analyze_document(doc['text'], doc['url'], doc['targets'], netowl_key,
+                                              session=session, artifacts_dir=artifacts_dir, cache=cache,
+                                              geocoder=geocoder, stream=args.stream_json, exporter=exporter,
+                                              ledger=ledger, netowl_url=args.netowl_url)
+        except Exception as err:
+            if doc.get('requeued', 0) >= args.requeue:
+                raise
+            doc['requeued'] = doc.get('requeued', 0) + 1
+            print(" Deferred {0} for another pass: {1}".format(doc['url'], err))
+            retry_queue.put(doc)
+            return None
+        del doc['text']
+        return doc
+
+    def publish(doc):
+        results = [(filename, [entity for entity in entity_list if is_reportable(entity)])
+                   for filename, entity_list in doc['results']]
+        if ledger is not None:
+            # Only reportable entities are queued, so only they may be marked as seen
+            results = [(filename, ledger.unseen(entity_list)) for filename, entity_list in results]
+        queued = sum(len(entity_list) for filename, entity_list in results)
+        if ledger is not None:
+            ledger.expect(doc['url'], queued, doc['targets'])
+        if page_cache is not None and 'page' in doc:
+            page_cache.expect(doc['url'], doc.pop('page'), doc['targets'], queued)
+        for filename, entity_list in results:
+            entity_count = publish_entities(entity_list, publisher)
+            metrics.count('entities_queued', entity_count)
+            print(" Successfully processed {0} entities in {1}\n"
+                  "-------------------------------------------------------".format(str(entity_count), filename + '.json'))
+        metrics.count('documents')
+        metrics.observe('document', time.perf_counter() - doc['started'])
+
+    pipeline = Pipeline(queue_size=args.queue_size)
+    pipeline.add_stage("fetch", fetch, args.workers)
+    pipeline.add_stage("extract", extract, args.workers)
+    pipeline.add_stage("netowl", analyze, args.workers)
+    pipeline.add_stage("geoevent", publish, args.workers)
+    try:
+        pending = docs
+        while pending:
+            pipeline.run(pending)
+            pending = []
+            while not retry_queue.empty():
+                pending.append(retry_queue.get())
+    finally:
+        publisher.close()
+        print(publisher.report())
+
+# Offline reprocessing
+_reprocess_geocoder = None
+
+def _init_reprocess_worker(geocode_cache, geocode_url=GEOCODE_SERVER_URL, token=None, offline=False, rates=None):
+    """Give each reprocessing worker process its own Geocoder, paced by its own RateLimiter."""
+    global _reprocess_geocoder
+    limiter = RateLimiter(rates=rates, routes={'geocode': geocode_url})
+    _reprocess_geocoder = Geocoder(HarvestSession(limiter=limiter), path=geocode_cache, token=token,
+                                   url=geocode_url, offline=offline)
+
+def find_netowl_json(directory):
+    """Return the archived NetOwl JSON files under directory, skipping .meta.json sidecars."""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.json') and not name.endswith('.meta.json'):
+                paths.append(os.path.join(root, name))
+    return paths
+
+def reprocess_targets(path, query_string=None, category=None):
+    """Return the URL and (filename, query, category) targets of an archived NetOwl file.
+
+    They come from the .meta.json sidecar written by --keep-artifacts;
+    query_string and category override what it recorded.
+    """
+    filename = os.path.basename(path)
+    for extension in ('.json', '.txt'):
+        if filename.endswith(extension):
+            filename = filename[:-len(extension)]
+    meta_path = os.path.join(os.path.dirname(path), filename + '.meta.json')
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+
+    targets = meta.get('targets') or [(filename, None, None)]
+    targets = [(target_file, query_string or target_query, category or target_category)
+               for target_file, target_query, target_category in targets]
+    return meta.get('url'), targets
+
+def reprocess_file(task):
+    """Run process_netowl_json over one archived file in a worker process.
+
+    Returns the path, the NDJSON lines for every record, the dicts of the
+    entities that would be sent to GeoEvent, when export is set the
+    (query, category, records) of every target for the exporter, and the
+    error the file failed with (None when it did not).
+    """
+    path, query_string, category, export = task
+    lines = []
+    reportable = []
+    exports = []
+    try:
+        web_url, targets = reprocess_targets(path, query_string, category)
+        with open(path, 'rb') as json_file:
             data = json.load(json_file)
 
-            entity_list, links_list, events_list = process_netowl_json(filename, data, j, query, args.category)
+        for target_file, target_query, target_category in targets:
+            records = list(iter_netowl_records(target_file, data, web_url, target_query, target_category,
+                                               _reprocess_geocoder))
+            if export:
+                exports.append((target_query, target_category, records))
+            for record in records:
+                values = record.to_dict()
+                values['record_type'] = record.record_type
+                lines.append(dumps_compact(values))
+                if record.record_type == 'entity' and is_reportable(record):
+                    reportable.append(record.to_dict())
+    except Exception as err:
+        return path, [], [], [], "{0}: {1}".format(type(err).__name__, err)
+    return path, lines, reportable, exports, None
+
+def reprocess_main(argv=None):
+    parser = argparse.ArgumentParser(prog="bucketize.py reprocess",
+                                     description="Re-run process_netowl_json over archived NetOwl JSON files.")
+    parser.add_argument("directory", help="Directory of NetOwl JSON files, e.g. one written with --keep-artifacts.")
+    parser.add_argument("-o", "--output", help="Write every entity, link and event as newline-delimited JSON ('-' for stdout).")
+    parser.add_argument("-g", "--geoevent", help="GeoEvent URL to publish reportable entities to.")
+    parser.add_argument("--export", help="Directory to write entities, links and events to as Parquet datasets.")
+    parser.add_argument("--export-chunk", help="Records buffered before they are flushed to Parquet.", type=int, default=10000)
+    parser.add_argument("-q", "--query", help="Query recorded on the records, overriding the archived one.")
+    parser.add_argument("-c", "--category", help="Category recorded on the records, overriding the archived one.")
+    parser.add_argument("-p", "--processes", help="Number of worker processes (default: one per core).", type=int)
+    parser.add_argument("--chunksize", help="Number of files handed to a worker at a time.", type=int, default=16)
+    parser.add_argument("--geocode-cache", help="SQLite file used to remember geocoded addresses between runs.")
+    parser.add_argument("--geocode-url", help="ArcGIS GeocodeServer the addresses are geocoded with.",
+                        default=GEOCODE_SERVER_URL)
+    parser.add_argument("--geocode-token", help="ArcGIS token; geocode addresses with the batch geocodeAddresses endpoint.")
+    parser.add_argument("--no-geocode", help="Never call the geocoder; only addresses in --geocode-cache get a location.",
+                        action="store_true")
+    parser.add_argument("--rate", help="Rate limit for geocode or geoevent as SERVICE=RATE[:BURST] requests per second, "
+                        "shared by every worker process; may be repeated.", type=parse_rate, action="append", default=[])
+    parser.add_argument("--batch-size", help="Max number of entities posted to GeoEvent in one request.", type=int, default=100)
+    args = parser.parse_args(argv)
+    if not args.output and not args.geoevent and not args.export:
+        parser.error("at least one of -o/--output, -g/--geoevent or --export is required")
+    exporter = None
+    if args.export:
+        try:
+            exporter = RecordExporter(args.export, chunk_rows=args.export_chunk)
+        except RuntimeError as err:
+            parser.error(str(err))
+
+    urllib3.disable_warnings()
+
+    paths = find_netowl_json(args.directory)
+    tasks = [(path, args.query, args.category, exporter is not None) for path in paths]
+
+    if args.output == '-':
+        output = sys.stdout.buffer
+    elif args.output:
+        output = open(args.output, 'wb')
+    else:
+        output = None
+    rates = {service: (rate, burst) for service, rate, burst in args.rate}
+    publisher = None
+    if args.geoevent:
+        limiter = RateLimiter(rates=rates, routes={'geoevent': args.geoevent})
+        publisher = GeoEventPublisher(args.geoevent, HarvestSession(limiter=limiter), batch_size=args.batch_size)
+    # Every worker paces itself, so each gets its share of the geocoder rate
+    processes = args.processes or os.cpu_count() or 1
+    worker_rates = {service: (rate / processes, burst) for service, (rate, burst) in rates.items()}
+
+    started = time.monotonic()
+    files = records = 0
+    failed = []
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_reprocess_worker,
+                                 initargs=(args.geocode_cache, args.geocode_url, args.geocode_token,
+                                           args.no_geocode, worker_rates)) as executor:
+            for path, lines, reportable, exports, error in executor.map(reprocess_file, tasks,
+                                                                        chunksize=max(1, args.chunksize)):
+                if error is not None:
+                    print(" Failed to reprocess {0}: {1}".format(path, error), file=sys.stderr)
+                    failed.append(path)
+                    continue
+                files += 1
+                records += len(lines)
+                if output is not None and lines:
+                    output.write(b'\n'.join(lines) + b'\n')
+                if publisher is not None:
+                    for entity in reportable:
+                        publisher.publish(entity)
+                for query_string, category, doc_records in exports:
+                    exporter.add(doc_records, query_string, category)
+    finally:
+        if output is not None and output is not sys.stdout.buffer:
+            output.close()
+        if exporter is not None:
+            exporter.close()
+            print(exporter.report(), file=sys.stderr)
+        if publisher is not None:
+            publisher.close()
+            print(publisher.report(), file=sys.stderr)
 
-            entity_count = 0
-            for entity in entity_list:
-                if entity.geo_entity == True:
-                    if entity.geo_type == 'coordinate' or entity.geo_type == 'address' or entity.geo_subtype == 'city':
-                        post_to_geoevent(entity.toJSON(), args.geoevent)
-                        entity_count +=1
+    elapsed = max(time.monotonic() - started, 1e-9)
+    print("Reprocessed {0} files ({1} records) in {2:.1f} s, {3:.1f} files/s".format(
+        files, records, elapsed, files / elapsed), file=sys.stderr)
+    if failed:
+        print("{0} files failed:\n{1}".format(len(failed), "\n".join(" " + path for path in failed)), file=sys.stderr)
+        sys.exit(1)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "reprocess":
+        return reprocess_main(sys.argv[2:])
 
-        os.remove(text_file_path)
-        os.remove(text_file_path + ".json")
-        print(" Successfully processed {0} entities in {1}".format(str(entity_count), filename + '.json'))
-        print("-------------------------------------------------------")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-q", "--query", help="Query for Google Search")
+    parser.add_argument("-m", "--max", help="Max number of results to return")
+    parser.add_argument("-d", "--directory", help="Directory to write text files harvested from the web.")
+    parser.add_argument("-c", "--category", help="Category for query.")
+    parser.add_argument("-f", "--query-file", help="CSV file of query,category,max rows to run in one batch.")
+    parser.add_argument("-g", "--geoevent", help="GeoEvent URL.", required=True)
+    parser.add_argument("--parser", help="HTML parser used to extract visible text.", choices=PARSERS, default="auto")
+    parser.add_argument("--extract-processes", help="Number of worker processes for HTML extraction (0 extracts in the pipeline itself).",
+                        type=int, default=0)
+    parser.add_argument("--max-page-bytes", help="Max MB downloaded per page; the rest is cut off (0 for no limit).",
+                        type=float, default=MAX_PAGE_BYTES / (1024 * 1024))
+    parser.add_argument("--keep-artifacts", help="Archive harvested text and NetOwl JSON in --directory.",
+                        action="store_true")
+    parser.add_argument("--export", help="Directory to write entities, links and events to as Parquet datasets, partitioned by query and category.")
+    parser.add_argument("--export-chunk", help="Records buffered before they are flushed to Parquet.", type=int, default=10000)
+    parser.add_argument("--stream-json", help="Parse NetOwl responses incrementally to keep memory flat on large documents.",
+                        action="store_true")
+    parser.add_argument("--cache", help="SQLite file used to cache NetOwl responses between runs.")
+    parser.add_argument("--cache-size", help="Max size of the NetOwl cache in MB.", type=float, default=512)
+    parser.add_argument("--cache-ttl", help="Hours before a cached NetOwl response expires.", type=float, default=168)
+    parser.add_argument("--page-cache", help="SQLite file used to skip pages that have not changed since the last run.")
+    parser.add_argument("--page-cache-size", help="Max size of the page cache in MB.", type=float, default=256)
+    parser.add_argument("--geocode-cache", help="SQLite file used to remember geocoded addresses between runs.")
+    parser.add_argument("--geocode-workers", help="Number of addresses geocoded at once.", type=int, default=8)
+    parser.add_argument("--geocode-miss-ttl", help="Hours an address without candidates is remembered in --geocode-cache.",
+                        type=float, default=24)
+    parser.add_argument("--geocode-token", help="ArcGIS token; enables batch geocoding with geocodeAddresses.")
+    parser.add_argument("--batch-size", help="Max number of entities posted to GeoEvent in one request.", type=int, default=100)
+    parser.add_argument("--flush-interval", help="Max seconds an entity waits before its batch is posted.", type=float, default=1.0)
+    parser.add_argument("--max-pending", help="Max number of entities buffered for GeoEvent before the pipeline waits.",
+                        type=int, default=1000)
+    parser.add_argument("-w", "--workers", help="Number of concurrent workers per pipeline stage.", type=int, default=4)
+    parser.add_argument("--queue-size", help="Max number of documents waiting between pipeline stages.", type=int, default=8)
+    parser.add_argument("--engine", help="Run the pipeline on worker threads or on a single asyncio event loop.",
+                        choices=["threads", "async"], default="threads")
+    parser.add_argument("--concurrency", help="Max number of documents in flight with the async engine.", type=int, default=100)
+    parser.add_argument("--per-host", help="Max number of simultaneous connections per host.", type=int, default=8)
+    parser.add_argument("--timeout", help="Timeout in seconds for each HTTP request.", type=float, default=60)
+    parser.add_argument("--retries", help="Number of retries for failed HTTP requests.", type=int, default=3)
+    parser.add_argument("--rate", help="Rate limit for a service as SERVICE=RATE[:BURST] requests per second, "
+                        "SERVICE one of {0}; may be repeated.".format(', '.join(SERVICES)),
+                        type=parse_rate, action="append", default=[])
+    parser.add_argument("--max-backoff", help="Max seconds a throttled service is paused for.", type=float, default=60)
+    parser.add_argument("--search-pause", help="Seconds to wait between Google result pages.", type=float, default=2.0)
+    parser.add_argument("--requeue", help="Times a document that failed at NetOwl or the geocoder is retried in a later pass.",
+                        type=int, default=2)
+    parser.add_argument("--search-url", help="Search service answering q/num with a JSON list of result URLs, used instead of Google.")
+    parser.add_argument("--netowl-url", help="NetOwl _process endpoint.", default=NETOWL_URL)
+    parser.add_argument("--geocode-url", help="ArcGIS GeocodeServer the addresses are geocoded with.",
+                        default=GEOCODE_SERVER_URL)
+    parser.add_argument("--ledger", help="SQLite job ledger; reruns skip finished URLs, resume the rest "
+                        "and only post entities GeoEvent has not received.")
+    parser.add_argument("--metrics", help="Write the run metrics to this file: Prometheus textfile for .prom, JSON otherwise.")
+    parser.add_argument("--profile", help="Run under cProfile and tracemalloc and write the results to --directory.",
+                        action="store_true")
+    args = parser.parse_args()
+    if args.query_file:
+        if args.query:
+            parser.error("use either -q/--query or -f/--query-file")
+        try:
+            queries = read_query_file(args.query_file)
+        except (OSError, ValueError) as err:
+            parser.error(str(err))
+    elif args.query and args.max and args.category:
+        queries = [(args.query, args.category, int(args.max))]
+    else:
+        parser.error("-q/--query, -m/--max and -c/--category are required without -f/--query-file")
+    if args.engine == "async" and aiohttp is None:
+        parser.error("--engine async requires the 'aiohttp' package")
+    if args.stream_json and ijson is None:
+        parser.error("--stream-json requires the 'ijson' package")
+    if args.keep_artifacts and not args.directory:
+        parser.error("--keep-artifacts requires -d/--directory")
+    artifacts_dir = args.directory if args.keep_artifacts else None
+    exporter = None
+    if args.export:
+        try:
+            exporter = RecordExporter(args.export, chunk_rows=args.export_chunk)
+        except RuntimeError as err:
+            parser.error(str(err))
+    cache = None
+    if args.cache:
+        cache = NetOwlCache(args.cache, max_bytes=int(args.cache_size * 1024 * 1024),
+                            ttl=args.cache_ttl * 3600)
+    geocoder = Geocoder(path=args.geocode_cache, workers=args.geocode_workers, token=args.geocode_token,
+                        url=args.geocode_url, miss_ttl=args.geocode_miss_ttl * 3600)
+    page_cache = None
+    if args.page_cache:
+        page_cache = PageCache(args.page_cache, max_bytes=int(args.page_cache_size * 1024 * 1024))
+    extract_pool = None
+    if args.extract_processes > 0:
+        extract_pool = ProcessPoolExecutor(max_workers=args.extract_processes)
+    ledger = JobLedger(args.ledger) if args.ledger else None
+    limiter = RateLimiter(rates={service: (rate, burst) for service, rate, burst in args.rate},
+                          routes={'search': args.search_url, 'netowl': args.netowl_url,
+                                  'geocode': args.geocode_url, 'geoevent': args.geoevent},
+                          max_backoff=args.max_backoff)
+    urllib3.disable_warnings()
+    if args.profile:
+        metrics.profiler = Profiler()
+        metrics.profiler.start()
+
+    netowl_key = 'netowl ff5e6185-5d63-459b-9765-4ebb905affc8'
+
+    try:
+        # to search 
+        docs = collect_results(queries, args.search_pause, limiter, args.search_url)
+        if ledger is not None:
+            docs = ledger.plan(docs)
+
+        if args.engine == "async":
+            engine = AsyncEngine(limit=args.concurrency, per_host=args.per_host,
+                                 timeout=args.timeout, retries=args.retries, limiter=limiter)
+            publisher = AsyncGeoEventPublisher(engine, args.geoevent, batch_size=args.batch_size,
+                                               flush_interval=args.flush_interval, max_pending=args.max_pending,
+                                               on_sent=on_sent_callback(ledger, page_cache))
+            asyncio.run(harvest_async(docs, publisher, netowl_key, engine, concurrency=args.concurrency,
+                                      artifacts_dir=artifacts_dir, cache=cache, geocoder=geocoder,
+                                      stream=args.stream_json, page_cache=page_cache, parser=args.parser,
+                                      extract_pool=extract_pool,
+                                      max_page_bytes=int(args.max_page_bytes * 1024 * 1024),
+                                      exporter=exporter, requeue=args.requeue, ledger=ledger,
+                                      netowl_url=args.netowl_url))
+            print(publisher.report())
+        else:
+            run_threaded(docs, args, netowl_key, artifacts_dir=artifacts_dir, cache=cache, geocoder=geocoder,
+                         page_cache=page_cache, extract_pool=extract_pool, exporter=exporter, limiter=limiter,
+                         ledger=ledger)
+    finally:
+        print(limiter.report())
+        if exporter is not None:
+            exporter.close()
+            print(exporter.report())
+        if cache is not None:
+            print(cache.report())
+            cache.close()
+        print(geocoder.report())
+        geocoder.close()
+        if page_cache is not None:
+            print(page_cache.report())
+            page_cache.close()
+        if extract_pool is not None:
+            extract_pool.shutdown()
+        if ledger is not None:
+            print(ledger.report())
+            ledger.close()
+        if metrics.profiler is not None:
+            for path in metrics.profiler.stop(args.directory or '.'):
+                print("Profile written to {0}".format(path))
+            metrics.profiler = None
+        print(metrics.report())
+        if args.metrics:
+            metrics.write(args.metrics)
 
 if __name__=="__main__":    
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,186 @@
+"""Columnar export of NetOwl records for bucketize.
+
+RecordExporter collects the entities, links and events of a harvest and
+writes them as Parquet, one dataset per record type, partitioned Hive
+style by query and category:
+
+    <directory>/entity/query=Japan%20Food/category=Warehouse/part-<run>.parquet
+
+Rows are buffered as columns and written as a row group every chunk_rows
+records, so memory stays bounded however long the harvest runs. Every run
+writes its own part files, so exporting into the same directory again
+appends to the dataset. Geo entities are also streamed to a GeoJSON
+FeatureCollection per partition next to the Parquet files.
+"""
+import json
+import os
+import threading
+import time
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Record types written to their own dataset
+RECORD_TYPES = ('entity', 'link', 'event')
+
+# Columns the datasets are partitioned by; they live in the directory names
+PARTITION_COLUMNS = ('query', 'category')
+
+# Hive's name for a partition whose value is missing
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# Record fields that are not strings
+FLOAT_FIELDS = frozenset(['lat', 'long'])
+BOOL_FIELDS = frozenset(['geo_entity', 'triple'])
+POINT_FIELDS = frozenset(['loc'])
+
+
+def field_type(name):
+    """Return the Arrow type of a record field."""
+    if name in FLOAT_FIELDS:
+        return pa.float64()
+    if name in BOOL_FIELDS:
+        return pa.bool_()
+    if name in POINT_FIELDS:
+        return pa.list_(pa.float64())
+    return pa.string()
+
+
+def column_value(name, value):
+    """Coerce a record value to the Python type of its Arrow column."""
+    if value is None:
+        return None
+    if name in FLOAT_FIELDS:
+        return float(value)
+    if name in POINT_FIELDS:
+        return [float(v) for v in value]
+    return value
+
+
+def partition_path(query_string, category):
+    """Return the Hive style query=.../category=... path of a partition."""
+    parts = []
+    for name, value in zip(PARTITION_COLUMNS, (query_string, category)):
+        parts.append("{0}={1}".format(name, NULL_PARTITION if value is None else quote(str(value), safe='')))
+    return os.path.join(*parts)
+
+
+class GeoJSONWriter:
+    """Stream features into a GeoJSON FeatureCollection file."""
+
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write('{"type":"FeatureCollection","features":[\n')
+        self.count = 0
+
+    def write(self, feature):
+        if self.count:
+            self.file.write(',\n')
+        self.file.write(json.dumps(feature, separators=(',', ':')))
+        self.count += 1
+
+    def close(self):
+        self.file.write('\n]}\n')
+        self.file.close()
+
+
+class RecordExporter:
+    """Accumulate NetOwl records into Arrow batches and flush them to Parquet.
+
+    add() is safe to call from several threads. Nothing is guaranteed to be
+    on disk until close() has been called.
+    """
+
+    def __init__(self, directory, chunk_rows=10000, geojson=True):
+        if pa is None:
+            raise RuntimeError("Parquet export requires the 'pyarrow' package")
+        self.directory = directory
+        self.chunk_rows = max(1, int(chunk_rows))
+        self.geojson = geojson
+        self.run_id = "{0}-{1}".format(time.strftime('%Y%m%dT%H%M%S'), os.getpid())
+        self.lock = threading.Lock()
+        self.buffers = {}
+        self.writers = {}
+        self.geo_writers = {}
+        self.buffered = 0
+        self.rows = dict.fromkeys(RECORD_TYPES, 0)
+        self.features = 0
+
+    def add(self, records, query_string=None, category=None):
+        """Buffer the entities, links and events of one document for a query and category."""
+        with self.lock:
+            for record in records:
+                record_type = getattr(record, 'record_type', None)
+                if record_type not in self.rows:
+                    continue
+                key = (record_type, query_string, category)
+                columns = self.buffers.get(key)
+                if columns is None:
+                    columns = self.buffers[key] = {name: [] for name in self._columns(record)}
+                for name, values in columns.items():
+                    values.append(column_value(name, getattr(record, name)))
+                self.rows[record_type] += 1
+                self.buffered += 1
+
+                if self.geojson and record_type == 'entity' and record.geo_entity and record.loc is not None:
+                    self._write_feature(record, query_string, category)
+
+            if self.buffered >= self.chunk_rows:
+                self._flush()
+
+    @staticmethod
+    def _columns(record):
+        return [name for name in record.__slots__ if name not in PARTITION_COLUMNS]
+
+    def _write_feature(self, entity, query_string, category):
+        key = (query_string, category)
+        writer = self.geo_writers.get(key)
+        if writer is None:
+            writer = self.geo_writers[key] = GeoJSONWriter(self._part_path('geojson', key, '.geojson'))
+        properties = entity.to_dict()
+        del properties['loc']
+        writer.write({'type': 'Feature',
+                      'geometry': {'type': 'Point', 'coordinates': [float(v) for v in entity.loc]},
+                      'properties': {name: column_value(name, value) for name, value in properties.items()}})
+        self.features += 1
+
+    def _part_path(self, dataset, partition, extension):
+        directory = os.path.join(self.directory, dataset, partition_path(*partition))
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, "part-{0}{1}".format(self.run_id, extension))
+
+    def _flush(self):
+        """Write every buffered partition as a row group of its Parquet file."""
+        for key, columns in self.buffers.items():
+            if not next(iter(columns.values())):
+                continue
+            schema = pa.schema([(name, field_type(name)) for name in columns])
+            table = pa.Table.from_pydict(columns, schema=schema)
+            writer = self.writers.get(key)
+            if writer is None:
+                path = self._part_path(key[0], key[1:], '.parquet')
+                writer = self.writers[key] = pq.ParquetWriter(path, schema)
+            writer.write_table(table)
+            for values in columns.values():
+                del values[:]
+        self.buffered = 0
+
+    def close(self):
+        """Flush what is left and finish every Parquet and GeoJSON file."""
+        with self.lock:
+            self._flush()
+            for writer in self.writers.values():
+                writer.close()
+            for writer in self.geo_writers.values():
+                writer.close()
+            self.writers = {}
+            self.geo_writers = {}
+            self.buffers = {}
+
+    def report(self):
+        return "Export: {0} entities, {1} links, {2} events, {3} geo features written to {4}".format(
+            self.rows['entity'], self.rows['link'], self.rows['event'], self.features, self.directory)
@@ -0,0 +1,123 @@
+"""HTML to visible text extraction for bucketize.
+
+Two parsers are available. The fast path feeds the page to lxml's HTML
+parser with a target object, so no tree is ever built: text is collected
+as it is parsed and everything inside style, script, head and title
+elements is dropped on the way. The BeautifulSoup path builds the full
+tree and is kept as a fallback for when lxml is not installed.
+
+Both take the charset from the HTTP Content-Type header when there is
+one; otherwise the parser detects the encoding from a BOM or a meta tag.
+"""
+import codecs
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+# Elements whose text is never visible on the page
+HIDDEN_TAGS = frozenset(['style', 'script', 'head', 'title'])
+
+# Bytes fed to lxml at a time
+FEED_SIZE = 64 * 1024
+
+PARSERS = ('auto', 'lxml', 'bs4')
+
+
+class VisibleTextTarget:
+    """lxml parser target that keeps the text outside hidden elements."""
+
+    def __init__(self):
+        self.parts = []
+        self.hidden = 0
+
+    def start(self, tag, attrib):
+        if tag in HIDDEN_TAGS:
+            self.hidden += 1
+
+    def end(self, tag):
+        if tag in HIDDEN_TAGS and self.hidden:
+            self.hidden -= 1
+
+    def data(self, data):
+        if not self.hidden:
+            self.parts.append(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        text = ''.join(self.parts)
+        self.parts = []
+        return text
+
+
+def content_charset(headers):
+    """Return the charset of a Content-Type response header, or None."""
+    content_type = headers.get('Content-Type') or ''
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'charset':
+            return value.strip().strip('"\'') or None
+    return None
+
+
+def extract_lxml(content, encoding=None):
+    """Return the visible text of an HTML page without building a tree."""
+    if not content:
+        return ''
+    parser = etree.HTMLParser(target=VisibleTextTarget(), remove_comments=True, encoding=encoding)
+    for start in range(0, len(content), FEED_SIZE):
+        parser.feed(content[start:start + FEED_SIZE])
+    return parser.close()
+
+
+def extract_bs4(content, encoding=None):
+    """Return the visible text of an HTML page using BeautifulSoup."""
+    soup = BeautifulSoup(content, features="lxml" if etree is not None else "html.parser", from_encoding=encoding)
+
+    for s in soup(['style', 'script', '[document]', 'head', 'title']):
+        s.extract()
+    return soup.getText()
+
+
+def extract_visible_text(content, parser='auto', encoding=None):
+    """Strip markup and non-visible elements from an HTML page.
+
+    parser is 'lxml' for the streaming fast path, 'bs4' for BeautifulSoup,
+    or 'auto' to use lxml whenever it is installed. encoding is the
+    charset the server declared (see content_charset); an unknown one is
+    ignored.
+    """
+    if encoding is not None:
+        try:
+            encoding = codecs.lookup(encoding).name
+        except LookupError:
+            encoding = None
+    if parser == 'auto':
+        parser = 'lxml' if etree is not None else 'bs4'
+    if parser == 'lxml':
+        return extract_lxml(content, encoding)
+    if parser == 'bs4':
+        return extract_bs4(content, encoding)
+    raise ValueError("Unknown parser '{0}', expected one of {1}".format(parser, ', '.join(PARSERS)))
+
+
+def read_limited(chunks, max_bytes):
+    """Join an iterable of byte chunks, stopping once max_bytes have been read.
+
+    A max_bytes of 0 or None reads everything.
+    """
+    body = bytearray()
+    for chunk in chunks:
+        body += chunk
+        if max_bytes and len(body) >= max_bytes:
+            del body[max_bytes:]
+            break
+    return bytes(body)
@@ -0,0 +1,252 @@
+"""Run instrumentation for bucketize.
+
+Metrics records how long each stage of a harvest takes (search, page
+fetch, text extraction, NetOwl, geocoding, record extraction, GeoEvent),
+how many bytes and records went through it and how deep the queues
+between stages got. At the end of a run it prints a summary table and
+can dump everything as JSON or as a Prometheus textfile.
+
+Profiler wraps a run in cProfile and tracemalloc. Before Python 3.12
+cProfile only sees the thread that enabled it, so every pipeline worker
+thread gets its own profile and they are merged when the run ends. From
+3.12 cProfile is built on sys.monitoring: the profile enabled by the
+main thread sees every thread, and only one profile may be active.
+"""
+import contextlib
+import cProfile
+import json
+import math
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+# Latency samples kept per stage to compute percentiles from
+MAX_SAMPLES = 10000
+
+# Whether one cProfile.Profile sees every thread (sys.monitoring)
+PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(samples, q):
+    """Return the q quantile of sorted samples (nearest rank)."""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))
+    return samples[index]
+
+
+class Histogram:
+    """Count, sum and a bounded random sample of latencies for one stage."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.samples = []
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.worst = max(self.worst, seconds)
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            # Reservoir sampling keeps every observation equally likely to be kept
+            slot = random.randrange(self.count)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = seconds
+
+    def summary(self):
+        samples = sorted(self.samples)
+        values = {'count': self.count, 'sum': self.total, 'max': self.worst}
+        for q in QUANTILES:
+            values['p{0:g}'.format(q * 100)] = percentile(samples, q)
+        return values
+
+
+class Gauge:
+    """Last, mean and highest value of a sampled level such as a queue depth."""
+
+    def __init__(self):
+        self.last = 0
+        self.highest = 0
+        self.total = 0
+        self.samples = 0
+
+    def set(self, value):
+        self.last = value
+        self.highest = max(self.highest, value)
+        self.total += value
+        self.samples += 1
+
+    def summary(self):
+        mean = self.total / self.samples if self.samples else 0.0
+        return {'last': self.last, 'mean': mean, 'max': self.highest}
+
+
+class Metrics:
+    """Thread-safe registry of stage timings, counters and gauges."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.profiler = None
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Time the body of a with block as one observation of stage."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self.lock:
+            gauge = self.gauges.get(name)
+            if gauge is None:
+                gauge = self.gauges[name] = Gauge()
+            gauge.set(value)
+
+    def thread_profile(self):
+        """Profile the calling thread while the Profiler is running."""
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.thread_profile()
+
+    def snapshot(self):
+        """Return every metric as plain JSON-ready data."""
+        with self.lock:
+            return {
+                'elapsed': time.monotonic() - self.started,
+                'stages': {stage: h.summary() for stage, h in self.histograms.items()},
+                'counters': dict(self.counters),
+                'gauges': {name: g.summary() for name, g in self.gauges.items()},
+            }
+
+    def report(self):
+        """Return the end-of-run summary table."""
+        data = self.snapshot()
+        lines = ["Stage timings ({0:.1f} s run):".format(data['elapsed']),
+                 " {0:<10} {1:>7} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}".format(
+                     'stage', 'count', 'total s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')]
+        for stage, values in data['stages'].items():
+            lines.append(" {0:<10} {1:>7} {2:>9.2f} {3:>9.1f} {4:>9.1f} {5:>9.1f} {6:>9.1f}".format(
+                stage, values['count'], values['sum'], values['p50'] * 1000, values['p95'] * 1000,
+                values['p99'] * 1000, values['max'] * 1000))
+        if data['counters']:
+            lines.append("Counts: " + ", ".join("{0} {1}".format(name, value)
+                                                for name, value in sorted(data['counters'].items())))
+        for name, values in sorted(data['gauges'].items()):
+            lines.append("Depth of {0}: mean {1:.1f}, max {2}".format(name, values['mean'], values['max']))
+        return "\n".join(lines)
+
+    def prometheus(self, prefix='bucketize'):
+        """Return every metric in the Prometheus text exposition format."""
+        data = self.snapshot()
+        lines = ["# TYPE {0}_stage_seconds summary".format(prefix)]
+        for stage, values in data['stages'].items():
+            for q in QUANTILES:
+                lines.append('{0}_stage_seconds{{stage="{1}",quantile="{2:g}"}} {3!r}'.format(
+                    prefix, stage, q, values['p{0:g}'.format(q * 100)]))
+            lines.append('{0}_stage_seconds_sum{{stage="{1}"}} {2!r}'.format(prefix, stage, values['sum']))
+            lines.append('{0}_stage_seconds_count{{stage="{1}"}} {2}'.format(prefix, stage, values['count']))
+        for name, value in sorted(data['counters'].items()):
+            lines.append("# TYPE {0}_{1}_total counter".format(prefix, name))
+            lines.append("{0}_{1}_total {2}".format(prefix, name, value))
+        for name, values in sorted(data['gauges'].items()):
+            lines.append("# TYPE {0}_{1}_max gauge".format(prefix, name))
+            lines.append("{0}_{1}_max {2}".format(prefix, name, values['max']))
+        lines.append("# TYPE {0}_run_seconds gauge".format(prefix))
+        lines.append("{0}_run_seconds {1!r}".format(prefix, data['elapsed']))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Dump the metrics to path: Prometheus textfile for .prom, JSON otherwise."""
+        if path.endswith('.prom'):
+            body = self.prometheus()
+        else:
+            body = json.dumps(self.snapshot(), indent=2, sort_keys=True) + "\n"
+        # Write then rename so a textfile collector never reads a partial file
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as out:
+            out.write(body)
+        os.replace(temp_path, path)
+
+
+class Profiler:
+    """cProfile and tracemalloc over a whole run, written out by stop()."""
+
+    def __init__(self, top=25):
+        self.top = top
+        self.lock = threading.Lock()
+        self.profiles = []
+        self.main = cProfile.Profile()
+
+    def start(self):
+        tracemalloc.start()
+        self.main.enable()
+
+    @contextlib.contextmanager
+    def thread_profile(self):
+        """Profile the calling thread where the main profile cannot see it."""
+        if PROFILES_ALL_THREADS:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active; the thread runs unprofiled rather than dying
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.lock:
+                self.profiles.append(profile)
+
+    def stop(self, directory):
+        """Write <stamp>.pstats and <stamp>.memory.txt to directory and return their paths."""
+        self.main.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        os.makedirs(directory, exist_ok=True)
+        stamp = "profile-" + time.strftime('%Y%m%dT%H%M%S')
+        stats_path = os.path.join(directory, stamp + '.pstats')
+        stats = pstats.Stats(self.main)
+        with self.lock:
+            for profile in self.profiles:
+                stats.add(profile)
+        stats.dump_stats(stats_path)
+
+        memory_path = os.path.join(directory, stamp + '.memory.txt')
+        with open(memory_path, 'w', encoding='utf-8') as out:
+            out.write("Traced memory: {0:.1f} MB current, {1:.1f} MB peak\n\n".format(
+                current / (1024 * 1024), peak / (1024 * 1024)))
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                out.write(str(stat) + "\n")
+        return stats_path, memory_path